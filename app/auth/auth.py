@@ -1,8 +1,15 @@
 from ..schemas import token as tokenSchema, user
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from ..database.database import engine
+from sqlalchemy.ext.asyncio import AsyncSession
+import os
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import sqlalchemy as db
+from ..database.database import get_db
+from ..cache import cache
 from ..models import models
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
@@ -17,8 +24,68 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 1051920
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt se ejecuta en un pool acotado de hilos para no bloquear el event loop
+password_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PASSWORD_WORKERS", "4")),
+                                       thread_name_prefix="bcrypt")
+
+# limite de intentos de login por usuario y por ip dentro de la ventana
+LOGIN_MAX_ATTEMPTS = int(os.getenv("LOGIN_MAX_ATTEMPTS", "10"))
+LOGIN_MAX_ATTEMPTS_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_IP", "100"))
+LOGIN_WINDOW = float(os.getenv("LOGIN_WINDOW", "60"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# usuarios autenticados recientemente, evita consultar la tabla user en cada peticion
+user_cache = cache.TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "1024")),
+                            ttl=float(os.getenv("USER_CACHE_TTL", "60")))
+
+
+def invalidate_user(usuario: str):
+    # descartar el usuario cacheado, se llama al modificar o bloquear un usuario
+    user_cache.invalidate(usuario)
+
+
+# intentos recientes de login por clave ("usuario:..." o "ip:...")
+login_attempts = cache.TTLCache(maxsize=10000, ttl=LOGIN_WINDOW)
+
+
+def check_login_attempts(usuario: str, ip: str):
+    ahora = time.monotonic()
+
+    # varios dependientes pueden compartir la ip del punto, su limite es mayor
+    for key, limite in ((f"usuario:{usuario}", LOGIN_MAX_ATTEMPTS), (f"ip:{ip}", LOGIN_MAX_ATTEMPTS_IP)):
+        intentos = login_attempts.get(key)
+        if intentos is None:
+            intentos = deque()
+
+        # descartar los intentos fuera de la ventana
+        while intentos and intentos[0] <= ahora - LOGIN_WINDOW:
+            intentos.popleft()
+
+        if len(intentos) >= limite:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Demasiados intentos, espere y vuelva a intentar",
+                headers={"Retry-After": str(int(intentos[0] + LOGIN_WINDOW - ahora) + 1)},
+            )
+
+        intentos.append(ahora)
+        login_attempts.set(key, intentos)
+
+
+def reset_login_attempts(usuario: str):
+    login_attempts.invalidate(f"usuario:{usuario}")
+
+
+async def verify_password(password: str, hashed: str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.verify, password, hashed)
+
+
+async def hash_password(password: str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.hash, password)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -30,21 +97,20 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def authenticate_user(usuario, password):
-   
-    session = Session(bind=engine, expire_on_commit=False)
-    user = session.query(models.User).where(models.User.usuario == usuario, models.User.activo == True).first()
+async def authenticate_user(session: AsyncSession, usuario, password):
+
+    user = await session.scalar(db.select(models.User).where(models.User.usuario == usuario, models.User.activo == True))
 
     if not user:
         return False
 
-    if not pwd_context.verify(password, user.password):
+    if not await verify_password(password, user.password):
         return False
 
     return user
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: Annotated[AsyncSession, Depends(get_db)]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pueden validar sus credenciales",
@@ -58,10 +124,14 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         token_data = tokenSchema.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    session = Session(bind=engine, expire_on_commit=False)
-    user = session.query(models.User).where(models.User.usuario == username, models.User.activo == True).first()
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        user = await session.scalar(db.select(models.User).where(models.User.usuario == username, models.User.activo == True))
+        if user is None:
+            raise credentials_exception
+        # separar la instancia de la sesion para compartirla entre peticiones
+        session.expunge(user)
+        user_cache.set(username, user)
     return user
 
 
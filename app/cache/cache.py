@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
+from ..models import models
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Cache en memoria del proceso, con expiracion por tiempo y desalojo LRU."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+
+        item = self._data.get(key)
+
+        if item is None:
+            return default
+
+        expira, value = item
+
+        # la entrada vencio, se descarta
+        if expira < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+
+        # desalojar la entrada usada hace mas tiempo
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+
+        self._data.pop(key, None)
+
+    def clear(self):
+
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# cache de respuestas de los reportes, la clave incluye la version de cada negocio del propietario
+# las escrituras incrementan la version del negocio y las respuestas anteriores dejan de leerse
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+
+class MemoryBackend:
+    """Respuestas y versiones en la memoria del proceso, cada worker tiene las suyas."""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.respuestas = TTLCache(maxsize, ttl)
+        self.versiones: dict = {}
+
+    async def get(self, key: str):
+        return self.respuestas.get(key)
+
+    async def set(self, key: str, value):
+        self.respuestas.set(key, value)
+
+    async def get_versiones(self, negocios: list):
+        return [self.versiones.get(negocio, 0) for negocio in negocios]
+
+    async def incr_version(self, negocio: int):
+        self.versiones[negocio] = self.versiones.get(negocio, 0) + 1
+
+
+class RedisBackend:
+    """Respuestas y versiones compartidas entre workers en un servidor compatible con redis."""
+
+    def __init__(self, url: str = RESPONSE_CACHE_URL, ttl: float = RESPONSE_CACHE_TTL, client=None):
+        if client is None:
+            # dependencia opcional, solo se necesita al configurar RESPONSE_CACHE_URL
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+
+    async def get(self, key: str):
+        value = await self.client.get("respuesta:" + key)
+        return None if value is None else json.loads(value)
+
+    async def set(self, key: str, value):
+        await self.client.set("respuesta:" + key, json.dumps(jsonable_encoder(value)), ex=int(self.ttl))
+
+    async def get_versiones(self, negocios: list):
+        if not negocios:
+            return []
+        values = await self.client.mget([f"version:{negocio}" for negocio in negocios])
+        return [int(value or 0) for value in values]
+
+    async def incr_version(self, negocio: int):
+        await self.client.incr(f"version:{negocio}")
+
+
+respuestas = RedisBackend() if RESPONSE_CACHE_URL else MemoryBackend()
+
+respuesta_stats = {"hits": 0, "misses": 0, "invalidaciones": 0, "errores": 0}
+
+
+async def leer(session: AsyncSession, endpoint: str, propietario_id: int, *params):
+
+    # devuelve la clave para guardar la respuesta y la respuesta guardada, o None
+    negocios = (await session.scalars(db.select(models.Negocio.id)\
+        .where(models.Negocio.propietario_id == propietario_id)\
+        .order_by(models.Negocio.id)))\
+        .all()
+
+    try:
+        versiones = await respuestas.get_versiones(negocios)
+        clave = f"{endpoint}:{propietario_id}:{json.dumps(jsonable_encoder(params))}:" + \
+            ",".join(f"{negocio}.{version}" for negocio, version in zip(negocios, versiones))
+        value = await respuestas.get(clave)
+    except Exception:
+        # la cache nunca impide responder, se calcula la respuesta sin guardarla
+        logger.warning("Cache de respuestas no disponible", exc_info=True)
+        respuesta_stats["errores"] += 1
+        return None, None
+
+    respuesta_stats["hits" if value is not None else "misses"] += 1
+    return clave, value
+
+
+async def guardar(clave: str | None, value):
+
+    if clave is None:
+        return
+
+    try:
+        await respuestas.set(clave, value)
+    except Exception:
+        logger.warning("Cache de respuestas no disponible", exc_info=True)
+        respuesta_stats["errores"] += 1
+
+
+async def invalidar(*negocios: int):
+
+    # despues del commit, las respuestas calculadas antes dejan de coincidir con la clave
+    for negocio in set(negocios):
+        if negocio is None:
+            continue
+        try:
+            await respuestas.incr_version(negocio)
+            respuesta_stats["invalidaciones"] += 1
+        except Exception:
+            logger.warning("No se pudo invalidar la cache del negocio %s", negocio, exc_info=True)
+            respuesta_stats["errores"] += 1
+
+
+async def invalidar_puntos(session: AsyncSession, *puntos: int):
+
+    negocios = (await session.scalars(db.select(models.Punto.negocio_id)\
+        .where(models.Punto.id.in_(puntos))))\
+        .all()
+
+    await invalidar(*negocios)
+
+
+def metricas():
+
+    consultas = respuesta_stats["hits"] + respuesta_stats["misses"]
+    return {**respuesta_stats, "tasa_aciertos": respuesta_stats["hits"] / consultas if consultas else 0.0}
@@ -0,0 +1,65 @@
+from datetime import date
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
+from ..models import models
+from ..fecha import fecha
+from ..respuesta import respuesta
+
+# cuadre de un punto por producto: distribuido, vendido en el periodo, vendido total, existencia y monto
+# una sola consulta, las ventas se agregan por distribucion antes de unirlas para no repetir cantidades
+
+
+def consulta(condiciones: list, fecha_inicio: date | None = None, fecha_fin: date | None = None):
+
+    periodo = fecha.rango(models.Venta.fecha, fecha_inicio, fecha_fin)
+
+    # ventas por distribucion, total y dentro del periodo con agregacion condicional
+    # las mismas condiciones limitan las ventas a las del punto antes de agrupar
+    ventas = db.select(models.Venta.distribucion_id,
+                       db.func.sum(models.Venta.cantidad).label("vendida_total"),
+                       db.func.sum(models.Venta.cantidad).filter(periodo).label("vendida"),
+                       db.func.sum(models.Venta.monto).filter(periodo).label("monto"))\
+        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+        .where(*condiciones)\
+        .group_by(models.Venta.distribucion_id)\
+        .subquery()
+
+    distribuida = db.func.sum(models.Distribucion.cantidad)
+    vendida_total = db.func.coalesce(db.func.sum(ventas.c.vendida_total), 0)
+
+    return db.select(models.Producto.id, models.Producto.nombre.label("nombre_producto"),
+                     distribuida.label("cantidad_distribuida"), models.Punto.nombre.label("nombre_punto"),
+                     db.func.max(models.Inventario.um).label("um"),
+                     db.func.max(models.Inventario.precio_venta).label("precio_venta"),
+                     db.func.coalesce(db.func.sum(ventas.c.vendida), 0).label("cantidad_vendida"),
+                     db.func.coalesce(db.func.sum(ventas.c.monto), 0).label("monto"),
+                     (distribuida - vendida_total).label("existencia"))\
+        .select_from(models.Distribucion)\
+        .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
+        .outerjoin(ventas, ventas.c.distribucion_id == models.Distribucion.id)\
+        .where(*condiciones)\
+        .group_by(models.Producto.id, models.Producto.nombre, models.Punto.id, models.Punto.nombre)\
+        .order_by(models.Punto.nombre, models.Producto.nombre, models.Producto.id)
+
+
+async def cuadre(session: AsyncSession, condiciones: list, fecha_inicio: date | None = None, fecha_fin: date | None = None):
+
+    # filas con existencia o con ventas en el periodo
+    resultdb = respuesta.filas(await session.execute(consulta(condiciones, fecha_inicio, fecha_fin)))
+    return [row for row in resultdb if row["existencia"] > 0 or row["cantidad_vendida"] > 0]
+
+
+async def resumen(session: AsyncSession, condiciones: list):
+
+    # productos con existencia, la cantidad vendida es la de todo el historico
+    resultdb = []
+    for row in await cuadre(session, condiciones):
+        if row["existencia"] > 0:
+            del row["monto"]
+            resultdb.append(row)
+
+    return resultdb
@@ -0,0 +1,144 @@
+import sys
+import json
+import logging
+from datetime import datetime, timedelta
+import sqlalchemy as db
+from .database import engine
+from ..models import models
+from ..cuadre import cuadre
+
+# verificacion de planes: falla si una consulta de los endpoints recorre completa una tabla grande
+# uso: python -m app.database.explain [--seed]
+# con --seed carga datos de prueba dentro de una transaccion que se deshace al terminar
+
+logger = logging.getLogger(__name__)
+
+# ids altos para no chocar con los datos existentes
+BASE = 10_000_000
+
+SEED = [
+    ('"user"', f"""INSERT INTO "user" (id, usuario, nombre, rol, activo, punto_id)
+        SELECT {BASE} + g, 'explain_' || g, 'explain', 'propietario', true, NULL FROM generate_series(0, 999) g"""),
+    ("negocio", f"""INSERT INTO negocio (id, nombre, fecha_licencia, activo, propietario_id)
+        SELECT {BASE} + g, 'explain', CURRENT_DATE + 30, true, {BASE} + g % 1000 FROM generate_series(0, 1999) g"""),
+    ("punto", f"""INSERT INTO punto (id, nombre, negocio_id)
+        SELECT {BASE} + g, 'explain', {BASE} + g % 2000 FROM generate_series(0, 4999) g"""),
+    ("producto", f"""INSERT INTO producto (id, nombre, negocio_id)
+        SELECT {BASE} + g, 'explain', {BASE} + g % 2000 FROM generate_series(0, 19999) g"""),
+    ("inventario", f"""INSERT INTO inventario (id, producto_id, cantidad, costo, monto, precio_venta, fecha, negocio_id)
+        SELECT {BASE} + g, {BASE} + g % 20000, 100, 1, 100, 2, CURRENT_DATE - g % 365, {BASE} + g % 2000
+        FROM generate_series(0, 49999) g"""),
+    ("distribucion", f"""INSERT INTO distribucion (id, inventario_id, cantidad, fecha, punto_id)
+        SELECT {BASE} + g, {BASE} + g % 50000, 10, CURRENT_DATE - g % 365, {BASE} + g % 5000
+        FROM generate_series(0, 99999) g"""),
+    ("factura", f"""INSERT INTO factura (id, monto, fecha, pago_electronico, punto_id)
+        SELECT {BASE} + g, 10, LOCALTIMESTAMP - g * INTERVAL '5 minutes', false, {BASE} + g % 5000
+        FROM generate_series(0, 49999) g"""),
+    ("venta", f"""INSERT INTO venta (id, distribucion_id, cantidad, precio, monto, fecha, pago_electronico, pago_diferido,
+                           punto_id, usuario_id, factura_id)
+        SELECT {BASE} + g, {BASE} + g % 100000, 1, 2, 2, LOCALTIMESTAMP - g * INTERVAL '1 minute', false, false,
+               {BASE} + g % 5000, {BASE} + g % 1000, {BASE} + g % 50000
+        FROM generate_series(0, 299999) g"""),
+    ("venta_diaria", f"""INSERT INTO venta_diaria (negocio_id, dia, punto_id, producto_id, cantidad, monto, costo,
+                                  monto_esperado, monto_electronico, monto_efectivo)
+        SELECT i.negocio_id, date(v.fecha), v.punto_id, i.producto_id, SUM(v.cantidad), SUM(v.monto),
+               SUM(v.cantidad * i.costo), SUM(v.cantidad * i.precio_venta), 0, SUM(v.monto)
+        FROM venta v JOIN distribucion d ON d.id = v.distribucion_id JOIN inventario i ON i.id = d.inventario_id
+        WHERE v.id >= {BASE}
+        GROUP BY i.negocio_id, date(v.fecha), v.punto_id, i.producto_id
+        ON CONFLICT DO NOTHING"""),
+]
+
+
+def consultas():
+
+    desde = datetime.now() - timedelta(days=7)
+    hasta = datetime.now()
+
+    # consultas con la forma de las que ejecutan los endpoints
+    return {
+        "ventas por punto y fecha": db.select(models.Venta.id, models.Venta.monto)\
+            .where(models.Venta.punto_id == BASE + 1, models.Venta.fecha >= desde, models.Venta.fecha < hasta),
+        "ventas de una distribucion": db.select(db.func.sum(models.Venta.cantidad))\
+            .where(models.Venta.distribucion_id == BASE + 1),
+        "ventas de una factura": db.select(models.Venta.id)\
+            .where(models.Venta.factura_id == BASE + 1),
+        "distribuciones de un inventario": db.select(db.func.sum(models.Distribucion.cantidad))\
+            .where(models.Distribucion.inventario_id == BASE + 1),
+        "distribuciones por punto y fecha": db.select(models.Distribucion.id)\
+            .where(models.Distribucion.punto_id == BASE + 1, models.Distribucion.fecha >= desde.date()),
+        "inventario por negocio y producto": db.select(models.Inventario.id)\
+            .where(models.Inventario.negocio_id == BASE + 1, models.Inventario.producto_id == BASE + 1),
+        "productos de un negocio": db.select(models.Producto.id)\
+            .where(models.Producto.negocio_id == BASE + 1),
+        "puntos de un negocio": db.select(models.Punto.id)\
+            .where(models.Punto.negocio_id == BASE + 1),
+        "negocios de un propietario": db.select(models.Negocio.id)\
+            .where(models.Negocio.propietario_id == BASE + 1),
+        "facturas de un punto": db.select(models.Factura.id)\
+            .where(models.Factura.punto_id == BASE + 1)\
+            .order_by(models.Factura.fecha.desc()).limit(50),
+        "ventas de un propietario": db.select(models.Venta.id)\
+            .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
+            .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+            .where(models.Negocio.propietario_id == BASE + 1, models.Venta.fecha >= desde),
+        "ventas diarias de un negocio": db.select(db.func.sum(models.VentaDiaria.monto))\
+            .where(models.VentaDiaria.negocio_id == BASE + 1, models.VentaDiaria.dia >= desde.date()),
+        "cuadre de un punto": cuadre.consulta([models.Punto.id == BASE + 1], desde.date(), hasta.date()),
+    }
+
+
+def seq_scans(plan: dict, tablas: set):
+
+    # tablas recorridas completas en el plan y sus subplanes
+    encontradas = []
+
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in tablas:
+        encontradas.append(plan["Relation Name"])
+
+    for subplan in plan.get("Plans", []):
+        encontradas += seq_scans(subplan, tablas)
+
+    return encontradas
+
+
+def verificar(conn):
+
+    tablas = {"venta", "venta_diaria", "distribucion", "inventario", "producto", "punto", "negocio", "factura"}
+    fallidas = []
+
+    for nombre, stmt in consultas().items():
+        sql = str(stmt.compile(conn, compile_kwargs={"literal_binds": True}))
+        plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        encontradas = seq_scans(plan[0]["Plan"], tablas)
+        if encontradas:
+            fallidas.append(nombre)
+            logger.error("FALLA %s: seq scan en %s", nombre, ", ".join(encontradas))
+        else:
+            logger.info("ok    %s", nombre)
+
+    return fallidas
+
+
+def main(seed: bool = False):
+
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            if seed:
+                for tabla, sql in SEED:
+                    conn.execute(db.text(sql))
+                    conn.exec_driver_sql(f"ANALYZE {tabla}")
+
+            return verificar(conn)
+        finally:
+            # nunca se guardan los datos de prueba
+            trans.rollback()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(1 if main(seed="--seed" in sys.argv) else 0)
@@ -0,0 +1,161 @@
+import json
+import logging
+import sqlalchemy as db
+from .database import Base, engine
+from ..models import models
+from ..venta_diaria import venta_diaria as acumulado
+
+# creacion y migraciones del esquema, se aplican en orden y cada version una sola vez
+# la aplicacion no toca el esquema al importarse, se ejecuta una vez por despliegue
+# uso: python -m app.database.migrations
+
+logger = logging.getLogger(__name__)
+
+metadata = db.MetaData()
+
+schema_version = db.Table(
+    "schema_version", metadata,
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("nombre", db.String(256)),
+    db.Column("fecha_aplicada", db.DateTime(timezone=True), server_default=db.func.now()),
+)
+
+
+def _columnas(conn, tabla: str):
+    return {col["name"] for col in db.inspect(conn).get_columns(tabla)}
+
+
+def _indices(conn, tabla: str):
+    return {ix["name"] for ix in db.inspect(conn).get_indexes(tabla)}
+
+
+def venta_factura_id(conn):
+
+    # relacionar cada venta con su factura
+    if "factura_id" not in _columnas(conn, "venta"):
+        conn.execute(db.text("ALTER TABLE venta ADD COLUMN factura_id INTEGER REFERENCES factura (id)"))
+
+    if "ix_venta_factura_id" not in _indices(conn, "venta"):
+        conn.execute(db.text("CREATE INDEX ix_venta_factura_id ON venta (factura_id)"))
+
+    # el detalle de la factura deja de estar limitado a 2048 caracteres
+    if conn.dialect.name == "postgresql":
+        conn.execute(db.text("ALTER TABLE factura ALTER COLUMN ventas TYPE TEXT"))
+
+    # completar factura_id a partir del json guardado en factura.ventas
+    facturas = conn.execute(db.text("SELECT id, ventas FROM factura WHERE ventas IS NOT NULL"))
+
+    lineas = []
+    for factura_id, ventas in facturas:
+        try:
+            for row in json.loads(ventas):
+                if row.get("id") is not None:
+                    lineas.append({"factura_id": factura_id, "venta_id": row["id"]})
+        except (ValueError, AttributeError):
+            logger.warning("Factura %s con detalle ilegible, no se enlazan sus ventas", factura_id)
+
+    if lineas:
+        conn.execute(db.text("UPDATE venta SET factura_id = :factura_id WHERE id = :venta_id AND factura_id IS NULL"),
+                     lineas)
+
+
+def existencia(conn):
+
+    # tablas de existencia materializada, se llenan a partir del historico
+    models.Existencia.__table__.create(conn, checkfirst=True)
+    models.ExistenciaAlmacen.__table__.create(conn, checkfirst=True)
+
+    conn.execute(db.text("""
+        INSERT INTO existencia (distribucion_id, cantidad)
+        SELECT d.id, d.cantidad - COALESCE((SELECT SUM(v.cantidad) FROM venta v WHERE v.distribucion_id = d.id), 0)
+        FROM distribucion d
+        WHERE NOT EXISTS (SELECT 1 FROM existencia e WHERE e.distribucion_id = d.id)
+    """))
+
+    conn.execute(db.text("""
+        INSERT INTO existencia_almacen (inventario_id, cantidad)
+        SELECT i.id, i.cantidad - COALESCE((SELECT SUM(d.cantidad) FROM distribucion d WHERE d.inventario_id = i.id), 0)
+        FROM inventario i
+        WHERE NOT EXISTS (SELECT 1 FROM existencia_almacen e WHERE e.inventario_id = i.id)
+    """))
+
+
+def indices(conn):
+
+    # indices declarados en los modelos para las columnas de join y filtro
+    # en postgres se crean dentro de la transaccion, bloquean escrituras mientras se construyen
+    # las tablas que aun no existen se crean con sus indices en una migracion posterior
+    for table in Base.metadata.tables.values():
+        if not db.inspect(conn).has_table(table.name):
+            continue
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def venta_diaria(conn):
+
+    # ventas acumuladas por dia, se llena a partir del historico
+    models.VentaDiaria.__table__.create(conn, checkfirst=True)
+    acumulado.reconstruir(conn)
+
+
+def idempotencia(conn):
+
+    # claves de idempotencia de las ventas enviadas por los clientes
+    models.Idempotencia.__table__.create(conn, checkfirst=True)
+
+
+def numeric(conn):
+
+    # cantidades y montos pasan de float a numeric, las sumas de los reportes son exactas
+    # en postgres reescribe las tablas y las bloquea mientras se convierten
+    if conn.dialect.name == "postgresql":
+        for table in (models.Inventario, models.Distribucion, models.Existencia, models.ExistenciaAlmacen,
+                      models.Venta, models.VentaDiaria, models.Factura):
+            columnas = [col for col in table.__table__.columns if isinstance(col.type, models.Exacto)]
+            tipos = ", ".join(f"ALTER COLUMN {col.name} TYPE {col.type.compile(conn.dialect)} USING {col.name}::numeric"
+                              for col in columnas)
+            conn.execute(db.text(f"ALTER TABLE {table.__tablename__} {tipos}"))
+
+    # los acumulados se vuelven a sumar a partir de las ventas ya convertidas
+    acumulado.reconstruir(conn)
+
+
+MIGRATIONS = [
+    (1, "venta_factura_id", venta_factura_id),
+    (2, "existencia", existencia),
+    (3, "indices", indices),
+    (4, "indices_fecha_venta", indices),
+    (5, "venta_diaria", venta_diaria),
+    (6, "idempotencia", idempotencia),
+    (7, "numeric", numeric),
+]
+
+
+def upgrade(engine=engine):
+
+    with engine.begin() as conn:
+
+        # evitar que dos procesos apliquen las migraciones a la vez
+        if conn.dialect.name == "postgresql":
+            conn.execute(db.text("SELECT pg_advisory_xact_lock(20240001)"))
+
+        metadata.create_all(conn)
+
+        # tablas que aun no existen, en una base nueva se crean con el esquema actual
+        Base.metadata.create_all(conn)
+
+        aplicadas = set(conn.scalars(db.select(schema_version.c.version)))
+
+        for version, nombre, migracion in MIGRATIONS:
+            if version in aplicadas:
+                continue
+
+            logger.info("Aplicando migracion %s %s", version, nombre)
+            migracion(conn)
+            conn.execute(db.insert(schema_version).values(version=version, nombre=nombre))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    upgrade()
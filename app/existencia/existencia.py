@@ -0,0 +1,114 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
+from ..models import models
+
+# existencia materializada por distribucion (en el punto) y por inventario (en almacen)
+# se actualiza en la misma transaccion que la venta, distribucion o inventario que la modifica
+
+
+def _por_id(columna, cantidades: dict):
+    return db.case(cantidades, value=columna, else_=0)
+
+
+async def vender(session: AsyncSession, pedido: dict, negocio_id: int | None = None):
+
+    # descontar {distribucion_id: cantidad} solo si alcanza la existencia de todas las distribuciones
+    # las filas quedan bloqueadas hasta el commit, dos ventas no pueden tomar lo mismo
+    # con negocio_id solo se descuenta de distribuciones de inventarios de ese negocio
+    if not pedido:
+        return True
+
+    if any(cantidad <= 0 for cantidad in pedido.values()):
+        return False
+
+    # con varias distribuciones las filas se bloquean primero en orden de id: el update de varias filas
+    # no define el orden en que las toma y dos facturas con las mismas distribuciones podrian esperarse mutuamente
+    if len(pedido) > 1:
+        await bloquear(session, pedido.keys())
+
+    cantidad = _por_id(models.Existencia.distribucion_id, pedido)
+    distribuciones = pedido.keys()
+
+    if negocio_id is not None:
+        distribuciones = db.select(models.Distribucion.id)\
+            .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+            .where(models.Distribucion.id.in_(pedido.keys()), models.Inventario.negocio_id == negocio_id)
+
+    result = await session.execute(db.update(models.Existencia)\
+        .where(models.Existencia.distribucion_id.in_(distribuciones), models.Existencia.cantidad >= cantidad)\
+        .values(cantidad=models.Existencia.cantidad - cantidad)\
+        .execution_options(synchronize_session=False))
+
+    # si alguna no alcanzo se devuelve False y el llamador no debe confirmar la transaccion
+    return result.rowcount == len(pedido)
+
+
+async def bloquear(session: AsyncSession, distribuciones):
+
+    # {distribucion_id: (existencia, negocio_id)} con las filas de existencia bloqueadas hasta el commit
+    # se bloquean en orden de id, dos ventas con las mismas distribuciones no se esperan mutuamente
+    if not distribuciones:
+        return {}
+
+    rows = await session.execute(db.select(models.Existencia.distribucion_id, models.Existencia.cantidad, models.Inventario.negocio_id)\
+        .join(models.Distribucion, models.Distribucion.id == models.Existencia.distribucion_id)\
+        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+        .where(models.Existencia.distribucion_id.in_(distribuciones))\
+        .order_by(models.Existencia.distribucion_id)\
+        .with_for_update(of=models.Existencia))
+
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+async def ajustar(session: AsyncSession, ajuste: dict):
+
+    # sumar {distribucion_id: cantidad} a la existencia, positivo al eliminar ventas
+    ajuste = {k: v for k, v in ajuste.items() if v}
+    if not ajuste:
+        return
+
+    await session.execute(db.update(models.Existencia)\
+        .where(models.Existencia.distribucion_id.in_(ajuste.keys()))\
+        .values(cantidad=models.Existencia.cantidad + _por_id(models.Existencia.distribucion_id, ajuste))\
+        .execution_options(synchronize_session=False))
+
+
+async def disponible(session: AsyncSession, distribucion_id: int):
+
+    return await session.scalar(db.select(models.Existencia.cantidad)\
+        .where(models.Existencia.distribucion_id == distribucion_id)) or 0
+
+
+async def crear(session: AsyncSession, distribucion_id: int, cantidad: float):
+
+    session.add(models.Existencia(distribucion_id=distribucion_id, cantidad=cantidad))
+
+
+async def ajustar_almacen(session: AsyncSession, ajuste: dict):
+
+    # sumar {inventario_id: cantidad} a la existencia en almacen, negativo al distribuir
+    ajuste = {k: v for k, v in ajuste.items() if v}
+    if not ajuste:
+        return
+
+    await session.execute(db.update(models.ExistenciaAlmacen)\
+        .where(models.ExistenciaAlmacen.inventario_id.in_(ajuste.keys()))\
+        .values(cantidad=models.ExistenciaAlmacen.cantidad + _por_id(models.ExistenciaAlmacen.inventario_id, ajuste))\
+        .execution_options(synchronize_session=False))
+
+
+async def crear_almacen(session: AsyncSession, inventario_id: int, cantidad: float):
+
+    session.add(models.ExistenciaAlmacen(inventario_id=inventario_id, cantidad=cantidad))
+
+
+def distribuido(condiciones: list):
+
+    # cantidad distribuida por inventario, agregada antes de unirla al inventario
+    # unir las distribuciones sin agrupar repite cada inventario una vez por distribucion
+    return db.select(models.Distribucion.inventario_id, db.func.sum(models.Distribucion.cantidad).label("cantidad"))\
+        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+        .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
+        .where(*condiciones)\
+        .group_by(models.Distribucion.inventario_id)\
+        .subquery()
@@ -0,0 +1,63 @@
+import io
+import csv
+import json
+from datetime import date, datetime
+from fastapi.responses import StreamingResponse
+from ..database.database import abrir_lectura
+
+# filas leidas del cursor del servidor por cada bloque enviado
+LOTE = 1000
+
+FORMATOS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+}
+
+
+def _valor(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+
+async def _lotes(stmt):
+
+    # sesion propia en la replica de lectura, la respuesta se sigue enviando despues de terminar el endpoint
+    async with await abrir_lectura() as session:
+        result = await session.stream(stmt.execution_options(yield_per=LOTE))
+        async for lote in result.partitions():
+            yield lote
+
+
+async def _ndjson(stmt, columnas: list):
+
+    async for lote in _lotes(stmt):
+        yield "".join(json.dumps({columna: _valor(valor) for columna, valor in zip(columnas, row)}) + "\n"
+                      for row in lote)
+
+
+async def _csv(stmt, columnas: list):
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columnas)
+
+    async for lote in _lotes(stmt):
+        writer.writerows([_valor(valor) for valor in row] for row in lote)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # encabezado de una exportacion sin filas
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def exportar(stmt, columnas: list, formato: str, nombre: str):
+
+    # respuesta en bloques, la memoria no depende de la cantidad de filas
+    media_type, extension = FORMATOS[formato]
+    contenido = _csv(stmt, columnas) if formato == "csv" else _ndjson(stmt, columnas)
+
+    return StreamingResponse(contenido, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{nombre}.{extension}"'})
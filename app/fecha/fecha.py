@@ -0,0 +1,43 @@
+from datetime import date, datetime, time, timedelta
+from pytz import UTC
+import sqlalchemy as db
+
+# diferencia de la hora local con UTC, create_venta la resta al guardar la fecha de la venta
+DESFASE = timedelta(hours=5)
+
+
+def naive_utc(fecha: datetime) -> datetime:
+
+    # las columnas DateTime de venta y factura no guardan zona horaria,
+    # el driver asyncpg no acepta fechas con zona para esas columnas
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone(UTC).replace(tzinfo=None)
+
+    return fecha
+
+
+def rango(columna, fecha_inicio: date | None, fecha_fin: date | None):
+
+    # filtro [fecha_inicio, fecha_fin + 1 dia) sobre la columna, sin funciones para poder usar su indice
+    # cualquiera de los dos extremos puede omitirse
+    tipo = columna.type
+    condiciones = []
+
+    if not isinstance(tipo, db.DateTime):
+        if fecha_inicio is not None:
+            condiciones.append(columna >= fecha_inicio)
+        if fecha_fin is not None:
+            condiciones.append(columna < fecha_fin + timedelta(days=1))
+        return db.and_(db.true(), *condiciones)
+
+    # las columnas con zona guardan UTC, el dia local empieza DESFASE despues
+    def limite(dia: date):
+        inicio = datetime.combine(dia, time.min)
+        return UTC.localize(inicio + DESFASE) if tipo.timezone else inicio
+
+    if fecha_inicio is not None:
+        condiciones.append(columna >= limite(fecha_inicio))
+    if fecha_fin is not None:
+        condiciones.append(columna < limite(fecha_fin + timedelta(days=1)))
+
+    return db.and_(db.true(), *condiciones)
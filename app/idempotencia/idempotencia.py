@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Annotated
+from fastapi import Header, HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects import postgresql, sqlite
+import sqlalchemy as db
+from ..database.database import engine
+from ..models import models
+from ..cache import cache
+
+# claves de idempotencia enviadas por los clientes, unicas por usuario
+# la clave se reserva en la misma transaccion que la operacion: una repeticion concurrente
+# espera el commit de la primera y encuentra la clave ya reservada con su respuesta
+# purgar las claves antiguas: python -m app.idempotencia.idempotencia [dias]
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCIA_DIAS = int(os.getenv("IDEMPOTENCIA_DIAS", "30"))
+
+# respuestas recientes por (usuario_id, clave), las repeticiones seguidas no consultan la base de datos
+respuestas_cache = cache.TTLCache(maxsize=int(os.getenv("IDEMPOTENCIA_CACHE_SIZE", "4096")),
+                                  ttl=float(os.getenv("IDEMPOTENCIA_CACHE_TTL", "600")))
+
+
+def get_clave(idempotency_key: Annotated[str | None, Header(min_length=1, max_length=256)] = None):
+
+    # clave del encabezado Idempotency-Key, opcional
+    return idempotency_key
+
+
+async def reservar(session: AsyncSession, usuario_id: int, ruta: str, claves: list):
+
+    # insert de todas las claves en una sola sentencia, devuelve las que no existian
+    if not claves:
+        return set()
+
+    insert = postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+    return set(await session.scalars(insert(models.Idempotencia)\
+        .values([{"usuario_id": usuario_id, "clave": clave, "ruta": ruta} for clave in claves])\
+        .on_conflict_do_nothing(index_elements=["usuario_id", "clave"])\
+        .returning(models.Idempotencia.clave)))
+
+
+async def respuestas(session: AsyncSession, usuario_id: int, claves: list):
+
+    # {clave: (ruta, respuesta)} de claves reservadas antes, la respuesta es None si no llego a guardarse
+    if not claves:
+        return {}
+
+    rows = await session.execute(db.select(models.Idempotencia.clave, models.Idempotencia.ruta, models.Idempotencia.respuesta)\
+        .where(models.Idempotencia.usuario_id == usuario_id, models.Idempotencia.clave.in_(claves)))
+
+    return {row[0]: (row[1], json.loads(row[2]) if row[2] is not None else None) for row in rows}
+
+
+async def guardar(session: AsyncSession, usuario_id: int, respuestas: dict):
+
+    # guardar {clave: respuesta} de claves reservadas, update por llave primaria de varias filas
+    if not respuestas:
+        return
+
+    await session.execute(db.update(models.Idempotencia),
+                          [{"usuario_id": usuario_id, "clave": clave, "respuesta": json.dumps(respuesta, default=str)}
+                           for clave, respuesta in respuestas.items()])
+
+
+async def liberar(session: AsyncSession, usuario_id: int, claves: list):
+
+    # las operaciones rechazadas no guardan su clave, el cliente puede reintentar
+    if not claves:
+        return
+
+    await session.execute(db.delete(models.Idempotencia)\
+        .where(models.Idempotencia.usuario_id == usuario_id, models.Idempotencia.clave.in_(claves))\
+        .execution_options(synchronize_session=False))
+
+
+async def repetida(session: AsyncSession, usuario_id: int, ruta: str, clave: str):
+
+    # respuesta original si la clave ya se uso, None si se reservo ahora para esta operacion
+    # si la operacion falla la transaccion se deshace y la clave queda libre
+    anterior = respuestas_cache.get((usuario_id, clave))
+
+    if anterior is None:
+        if await reservar(session, usuario_id, ruta, [clave]):
+            return None
+        anterior = (await respuestas(session, usuario_id, [clave])).get(clave)
+
+    if anterior is None or anterior[0] != ruta or anterior[1] is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"La clave de idempotencia ya fue usada en otra operación")
+
+    respuestas_cache.set((usuario_id, clave), anterior)
+    return anterior[1]
+
+
+async def registrar(session: AsyncSession, usuario_id: int, clave: str, respuesta):
+
+    # guardar la respuesta con la operacion, antes del commit
+    respuesta = jsonable_encoder(respuesta)
+    await guardar(session, usuario_id, {clave: respuesta})
+    return respuesta
+
+
+def recordar(usuario_id: int, ruta: str, clave: str, respuesta):
+
+    # despues del commit la respuesta queda en memoria para las repeticiones
+    respuestas_cache.set((usuario_id, clave), (ruta, respuesta))
+
+
+def purgar(conn, dias: int = IDEMPOTENCIA_DIAS):
+
+    # claves mas antiguas que los dias indicados, un cliente no reintenta despues de tanto tiempo
+    limite = datetime.now(timezone.utc) - timedelta(days=dias)
+    return conn.execute(db.delete(models.Idempotencia).where(models.Idempotencia.fecha_creado < limite)).rowcount
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    dias = int(sys.argv[1]) if len(sys.argv) > 1 else IDEMPOTENCIA_DIAS
+
+    with engine.begin() as conn:
+        eliminadas = purgar(conn, dias)
+
+    logger.info("%s claves de idempotencia eliminadas, anteriores a %s dias", eliminadas, dias)
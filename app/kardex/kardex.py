@@ -0,0 +1,106 @@
+from datetime import date, timedelta
+from fastapi import HTTPException, status
+import sqlalchemy as db
+from ..models import models
+from ..fecha import fecha
+
+# tarjeta de inventario (kardex) de un producto: entradas al almacen, salidas a los puntos y ventas
+# una sola consulta UNION ALL ordenada por (fecha, orden, movimiento_id) con los saldos acumulados:
+# existencia_almacen = entradas - salidas, existencia = entradas - ventas (almacen y puntos)
+# los saldos parten de los movimientos anteriores al periodo, sumados en la misma consulta
+
+ACCIONES = ("Entrada", "Salida", "Venta")
+
+COLUMNAS = ["id", "movimiento_id", "accion", "fecha", "nombre", "negocio_id", "nombre_punto", "cantidad", "costo",
+            "precio_venta", "existencia_almacen", "existencia"]
+
+
+def movimientos(producto_id: int, propietario_id: int, fecha_inicio: date | None, fecha_fin: date | None):
+
+    # un select por tipo de movimiento con las mismas columnas, las constantes se escriben en el sql
+    # para que postgres conozca su tipo en el union
+    # almacen y total son lo que cada movimiento suma o resta a cada saldo
+    condiciones = [models.Producto.id == producto_id, models.Negocio.propietario_id == propietario_id]
+
+    def columnas(orden: int, id, dia, cantidad, punto, almacen, total):
+        return [db.literal_column(str(orden), db.Integer).label("orden"), id.label("movimiento_id"),
+                db.literal_column(f"'{ACCIONES[orden]}'", db.String).label("accion"),
+                dia.label("fecha"), models.Producto.nombre.label("nombre"), models.Negocio.nombre.label("negocio_id"),
+                punto.label("nombre_punto"), cantidad.label("cantidad"), models.Inventario.costo.label("costo"),
+                models.Inventario.precio_venta.label("precio_venta"), almacen.label("almacen"), total.label("total")]
+
+    entradas = db.select(*columnas(0, models.Inventario.id, models.Inventario.fecha, models.Inventario.cantidad,
+                                   db.null(), models.Inventario.cantidad, models.Inventario.cantidad))\
+        .select_from(models.Inventario)\
+        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
+        .where(*condiciones, fecha.rango(models.Inventario.fecha, fecha_inicio, fecha_fin))
+
+    salidas = db.select(*columnas(1, models.Distribucion.id, models.Distribucion.fecha, models.Distribucion.cantidad,
+                                  models.Punto.nombre, -models.Distribucion.cantidad, db.literal_column("0", db.Integer)))\
+        .select_from(models.Distribucion)\
+        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
+        .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+        .where(*condiciones, fecha.rango(models.Distribucion.fecha, fecha_inicio, fecha_fin))
+
+    ventas = db.select(*columnas(2, models.Venta.id, db.func.date(models.Venta.fecha, type_=db.Date), models.Venta.cantidad,
+                                 models.Punto.nombre, db.literal_column("0", db.Integer), -models.Venta.cantidad))\
+        .select_from(models.Venta)\
+        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
+        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
+        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+        .where(*condiciones, fecha.rango(models.Venta.fecha, fecha_inicio, fecha_fin))
+
+    return db.union_all(entradas, salidas, ventas).subquery()
+
+
+def crear_cursor(row: dict):
+    return f"{row['fecha'].isoformat()}_{ACCIONES.index(row['accion'])}_{row['movimiento_id']}"
+
+
+def leer_cursor(cursor: str):
+
+    # el cursor es la (fecha, orden, movimiento_id) del ultimo movimiento de la pagina anterior
+    try:
+        dia, orden, id = cursor.split("_")
+        return date.fromisoformat(dia), int(orden), int(id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Cursor no válido")
+
+
+def consulta(producto_id: int, propietario_id: int, fecha_inicio: date, fecha_fin: date,
+             cursor: str | None = None, limite: int | None = None):
+
+    # saldos al inicio del periodo
+    anteriores = movimientos(producto_id, propietario_id, None, fecha_inicio - timedelta(days=1))
+    inicial_almacen = db.select(db.func.coalesce(db.func.sum(anteriores.c.almacen), 0)).scalar_subquery()
+    inicial = db.select(db.func.coalesce(db.func.sum(anteriores.c.total), 0)).scalar_subquery()
+
+    # saldo acumulado de cada movimiento en el orden de la tarjeta
+    periodo = movimientos(producto_id, propietario_id, fecha_inicio, fecha_fin)
+    orden = [periodo.c.fecha, periodo.c.orden, periodo.c.movimiento_id]
+    acumulado = {"order_by": orden, "rows": (None, 0)}
+
+    tarjeta = db.select(periodo.c.orden,
+                        (periodo.c.accion + "-" + db.cast(periodo.c.movimiento_id, db.String)).label("id"),
+                        *[periodo.c[columna] for columna in COLUMNAS[1:10]],
+                        (inicial_almacen + db.func.sum(periodo.c.almacen).over(**acumulado)).label("existencia_almacen"),
+                        (inicial + db.func.sum(periodo.c.total).over(**acumulado)).label("existencia"))\
+        .subquery()
+
+    # la pagina se toma despues de calcular los saldos, cada movimiento conserva el suyo
+    stmt = db.select(*[tarjeta.c[columna] for columna in COLUMNAS])\
+        .order_by(tarjeta.c.fecha, tarjeta.c.orden, tarjeta.c.movimiento_id)
+
+    if cursor:
+        stmt = stmt.where(db.tuple_(tarjeta.c.fecha, tarjeta.c.orden, tarjeta.c.movimiento_id) > db.tuple_(*leer_cursor(cursor)))
+
+    if limite is not None:
+        stmt = stmt.limit(limite)
+
+    return stmt
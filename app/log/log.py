@@ -1,24 +1,98 @@
-from sqlalchemy.orm import Session
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
 from ..models import models
-from typing import List, Annotated
-from fastapi import Depends
-from ..auth import auth
-from ..database.database import Base, engine
+from ..database.database import SessionLocal
 
+# configuracion del escritor de logs en segundo plano
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_MS = int(os.getenv("LOG_FLUSH_MS", "200"))
 
-def create_log(log: dict):
+logger = logging.getLogger(__name__)
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+# cola de logs pendientes y tarea que la vacia, se crean al iniciar la aplicacion
+queue: asyncio.Queue | None = None
+writer_task: asyncio.Task | None = None
 
-    # create an instance of the log database model
-    logdb = models.Log(usuario=log["usuario"], accion=log["accion"],
-                       tabla=log["tabla"], descripcion=log["descripcion"], )
 
-    # add it to the session and commit it
-    session.add(logdb)
-    session.commit()
-    session.refresh(logdb)
+def _row(log: dict):
+    # la fecha se toma al registrar la accion, no al escribir el lote
+    return {"usuario": log["usuario"], "accion": log["accion"],
+            "tabla": log["tabla"], "descripcion": log["descripcion"],
+            "fecha_creado": datetime.now(timezone.utc)}
 
-    # close the session
-    session.close()
+
+async def create_log(log: dict, session: AsyncSession | None = None):
+
+    # misma transaccion: el log se guarda con el commit de la sesion recibida
+    if session is not None:
+        session.add(models.Log(**_row(log)))
+        return
+
+    # sin escritor activo se inserta directamente
+    if writer_task is None or writer_task.done():
+        await write_logs([_row(log)])
+        return
+
+    # si la cola esta llena se espera a que el escritor libere espacio
+    await queue.put(_row(log))
+
+
+async def write_logs(rows: list):
+
+    # insert de varias filas en una sola sentencia
+    async with SessionLocal() as session:
+        await session.execute(db.insert(models.Log), rows)
+        await session.commit()
+
+
+async def _writer():
+
+    while True:
+        rows = [await queue.get()]
+
+        # juntar logs hasta completar el lote o agotar el intervalo
+        limite = asyncio.get_running_loop().time() + LOG_FLUSH_MS / 1000
+        while len(rows) < LOG_BATCH_SIZE:
+            espera = limite - asyncio.get_running_loop().time()
+            if espera <= 0:
+                break
+            try:
+                rows.append(await asyncio.wait_for(queue.get(), espera))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            await write_logs(rows)
+        except Exception:
+            logger.exception("No se pudieron guardar %s logs", len(rows))
+        finally:
+            for _ in rows:
+                queue.task_done()
+
+
+async def start_writer():
+    global queue, writer_task
+
+    queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+    writer_task = asyncio.create_task(_writer())
+
+
+async def stop_writer():
+    global writer_task
+
+    if writer_task is None:
+        return
+
+    # escribir lo pendiente antes de cerrar
+    await queue.join()
+    writer_task.cancel()
+    try:
+        await writer_task
+    except asyncio.CancelledError:
+        pass
+    writer_task = None
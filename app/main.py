@@ -1,16 +1,47 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import os
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from .routers import user, negocio, punto, producto, inventario, distribucion, venta, dependiente, factura
 from .schemas import token, user as schemaUser
 from typing import Annotated
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from .auth import auth
+from .log import log
+from .cache import cache
 from datetime import datetime, timedelta, date
 from .models import models
+from .database.database import engine, get_db, pool_metrics
+from .database import migrations
+from .idempotencia import idempotencia
+from .respuesta import respuesta
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
+from contextlib import asynccontextmanager
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+# aplicar las migraciones al iniciar cada worker
+MIGRAR_AL_INICIAR = os.getenv("MIGRAR_AL_INICIAR", "true").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # crear el esquema y aplicar las migraciones pendientes, con varios workers se puede
+    # desactivar y ejecutar una sola vez antes de iniciarlos: python -m app.database.migrations
+    if MIGRAR_AL_INICIAR:
+        migrations.upgrade()
+
+        # descartar las claves de idempotencia vencidas, tambien se puede programar con su modulo
+        with engine.begin() as conn:
+            idempotencia.purgar(conn)
+
+    # escritor de logs en segundo plano, al cerrar guarda los pendientes
+    await log.start_writer()
+    yield
+    await log.stop_writer()
+
+
+# respuestas serializadas con orjson
+app = FastAPI(lifespan=lifespan, default_response_class=respuesta.RespuestaJSON)
 
 
 origins = [
@@ -23,6 +54,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -44,15 +76,20 @@ async def index():
 
 
 @app.post("/token", response_model=token.Token)
-async def login_for_access_token(form_data: Annotated[auth.OAuth2PasswordRequestForm, Depends()]):
+async def login_for_access_token(request: Request, form_data: Annotated[auth.OAuth2PasswordRequestForm, Depends()], session: Annotated[AsyncSession, Depends(get_db)]):
 
-    user = auth.authenticate_user(form_data.username, form_data.password)
+    # rechazar rafagas de intentos antes de verificar la contraseña
+    ip = request.client.host if request.client else "desconocida"
+    auth.check_login_attempts(form_data.username, ip)
+
+    user = await auth.authenticate_user(session, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario o contraseña incorrecto",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    auth.reset_login_attempts(form_data.username)
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user.usuario}, expires_delta=access_token_expires
@@ -63,3 +100,25 @@ async def login_for_access_token(form_data: Annotated[auth.OAuth2PasswordRequest
 @app.get("/users/me/", response_model=schemaUser.User)
 async def read_users_me(current_user: Annotated[models.User, Depends(auth.get_current_active_user)]):
     return current_user
+
+
+@app.get("/metricas-pool", tags=["admin"], description="Metricas del pool de conexiones")
+async def read_pool_metrics(current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+
+    #validando rol de usuario autenticado
+    if current_user.rol != "superadmin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    return pool_metrics()
+
+
+@app.get("/metricas-cache", tags=["admin"], description="Metricas de la cache de respuestas")
+async def read_cache_metrics(current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+
+    #validando rol de usuario autenticado
+    if current_user.rol != "superadmin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    return cache.metricas()
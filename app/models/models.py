@@ -1,12 +1,37 @@
+from decimal import Decimal
 from pydantic import Json
-from sqlalchemy import JSON, Column, Integer, String, ForeignKey, Float, Boolean, Date, DateTime
+from sqlalchemy import JSON, Column, Index, Integer, String, Text, ForeignKey, Numeric, Boolean, Date, DateTime
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.sql import func
 from ..database.database import Base
 from sqlalchemy.orm import relationship, Mapped
 from datetime import date, datetime
 
+
+class Exacto(TypeDecorator):
+    """Numeric en la base de datos, float en python para los schemas y la aritmetica de los routers."""
+
+    impl = Numeric
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        # el float se guarda por su representacion mas corta, 0.1 es 0.1 y no 0.1000000000000000055
+        return Decimal(repr(value)) if isinstance(value, float) else value
+
+    def process_result_value(self, value, dialect):
+        return float(value) if value is not None else None
+
+
+# cantidades con tres decimales (kg, litros) y montos con dos
+# las sumas de la base de datos son exactas, el redondeo a float ocurre solo al leer el resultado
+CANTIDAD = Exacto(14, 3)
+DINERO = Exacto(14, 2)
+# acumulados de productos cantidad * precio, sin escala fija para no redondear
+ACUMULADO = Exacto()
+
 class Negocio(Base):
     __tablename__ = 'negocio'
+    __table_args__ = (Index("ix_negocio_propietario_id", "propietario_id"),)
     id: Mapped[int] = Column(Integer, primary_key=True)
     nombre: Mapped[str] = Column(String(256))
     direccion: Mapped[str] = Column(String(256))
@@ -25,6 +50,7 @@ class Negocio(Base):
 
 class Punto(Base):
     __tablename__ = 'punto'
+    __table_args__ = (Index("ix_punto_negocio_id", "negocio_id"),)
     id: Mapped[int] = Column(Integer, primary_key=True)
     nombre: Mapped[str] = Column(String(256))
     direccion: Mapped[str] = Column(String(256))
@@ -42,6 +68,7 @@ class Punto(Base):
 
 class Producto(Base):
     __tablename__ = 'producto'
+    __table_args__ = (Index("ix_producto_negocio_id", "negocio_id"),)
     id: Mapped[int] = Column(Integer, primary_key=True)
     nombre: Mapped[str] = Column(String(256))
     negocio_id: Mapped[int] = Column(Integer, ForeignKey("negocio.id"))
@@ -55,13 +82,17 @@ class Producto(Base):
 
 class Inventario(Base):
     __tablename__ = 'inventario'
+    __table_args__ = (
+        Index("ix_inventario_negocio_id_producto_id", "negocio_id", "producto_id"),
+        Index("ix_inventario_producto_id", "producto_id"),
+    )
     id: Mapped[int] = Column(Integer, primary_key=True)
     producto_id: Mapped[str] = Column(Integer, ForeignKey("producto.id"))
-    cantidad: Mapped[float] = Column(Float(2))
+    cantidad: Mapped[float] = Column(CANTIDAD)
     um: Mapped[str] = Column(String(256))
-    costo: Mapped[float] = Column(Float(2))
-    monto: Mapped[float] = Column(Float(2))
-    precio_venta: Mapped[float] = Column(Float(2))
+    costo: Mapped[float] = Column(DINERO)
+    monto: Mapped[float] = Column(DINERO)
+    precio_venta: Mapped[float] = Column(DINERO)
     fecha: Mapped[datetime] = Column(Date)
     negocio_id: Mapped[int] = Column(Integer, ForeignKey("negocio.id"))
     fecha_creado: Mapped[datetime] = Column(
@@ -75,9 +106,13 @@ class Inventario(Base):
 
 class Distribucion(Base):
     __tablename__ = 'distribucion'
+    __table_args__ = (
+        Index("ix_distribucion_inventario_id", "inventario_id"),
+        Index("ix_distribucion_punto_id_fecha", "punto_id", "fecha"),
+    )
     id: Mapped[int] = Column(Integer, primary_key=True)
     inventario_id: Mapped[str] = Column(Integer, ForeignKey("inventario.id"))
-    cantidad: Mapped[float] = Column(Float(2))
+    cantidad: Mapped[float] = Column(CANTIDAD)
     fecha: Mapped[datetime] = Column(Date)
     punto_id: Mapped[str] = Column(Integer, ForeignKey("punto.id"))
     fecha_creado: Mapped[datetime] = Column(
@@ -89,13 +124,46 @@ class Distribucion(Base):
     ventas: Mapped[int] = relationship("Venta", back_populates = "distribuciones", cascade="all, delete-orphan")
 
 
+class Existencia(Base):
+    __tablename__ = 'existencia'
+    distribucion_id: Mapped[int] = Column(Integer, ForeignKey("distribucion.id", ondelete="CASCADE"), primary_key=True)
+    cantidad: Mapped[float] = Column(CANTIDAD)
+
+
+class ExistenciaAlmacen(Base):
+    __tablename__ = 'existencia_almacen'
+    inventario_id: Mapped[int] = Column(Integer, ForeignKey("inventario.id", ondelete="CASCADE"), primary_key=True)
+    cantidad: Mapped[float] = Column(CANTIDAD)
+
+
+class VentaDiaria(Base):
+    __tablename__ = 'venta_diaria'
+    negocio_id: Mapped[int] = Column(Integer, ForeignKey("negocio.id", ondelete="CASCADE"), primary_key=True)
+    dia: Mapped[date] = Column(Date, primary_key=True)
+    punto_id: Mapped[int] = Column(Integer, ForeignKey("punto.id", ondelete="CASCADE"), primary_key=True)
+    producto_id: Mapped[int] = Column(Integer, ForeignKey("producto.id", ondelete="CASCADE"), primary_key=True)
+    cantidad: Mapped[float] = Column(CANTIDAD)
+    monto: Mapped[float] = Column(ACUMULADO)
+    costo: Mapped[float] = Column(ACUMULADO)
+    monto_esperado: Mapped[float] = Column(ACUMULADO)
+    monto_electronico: Mapped[float] = Column(ACUMULADO)
+    monto_efectivo: Mapped[float] = Column(ACUMULADO)
+
+
 class Venta(Base):
     __tablename__ = 'venta'
+    __table_args__ = (
+        Index("ix_venta_punto_id_fecha", "punto_id", "fecha"),
+        Index("ix_venta_distribucion_id_fecha", "distribucion_id", "fecha"),
+        Index("ix_venta_usuario_id", "usuario_id"),
+        Index("ix_venta_fecha", "fecha"),
+        Index("ix_venta_fecha_creado", "fecha_creado"),
+    )
     id: Mapped[int] = Column(Integer, primary_key=True)
     distribucion_id: Mapped[str] = Column(Integer, ForeignKey("distribucion.id"))
-    cantidad: Mapped[float] = Column(Float(2))
-    precio: Mapped[float] = Column(Float(2))
-    monto: Mapped[float] = Column(Float(2))
+    cantidad: Mapped[float] = Column(CANTIDAD)
+    precio: Mapped[float] = Column(DINERO)
+    monto: Mapped[float] = Column(DINERO)
     fecha: Mapped[datetime] = Column(DateTime)
     pago_electronico: Mapped[bool] = Column(Boolean)
     no_operacion: Mapped[str | None] = Column(String(256))
@@ -103,6 +171,7 @@ class Venta(Base):
     descripcion: Mapped[str | None] = Column(String(256))
     punto_id: Mapped[str] = Column(Integer, ForeignKey("punto.id"))
     usuario_id: Mapped[str] = Column(Integer, ForeignKey("user.id"))
+    factura_id: Mapped[int | None] = Column(Integer, ForeignKey("factura.id"), index=True)
     fecha_creado: Mapped[datetime] = Column(
         DateTime(timezone=True), server_default=func.now()
     )
@@ -114,6 +183,7 @@ class Venta(Base):
 
 class User(Base):
     __tablename__ = 'user'
+    __table_args__ = (Index("ix_user_punto_id", "punto_id"),)
     id: Mapped[int] = Column(Integer, primary_key=True)
     usuario: Mapped[str] = Column(String(256), unique=True)
     nombre: Mapped[str] = Column(String(256))
@@ -143,11 +213,24 @@ class Log(Base):
     )
 
 
+class Idempotencia(Base):
+    __tablename__ = 'idempotencia'
+    __table_args__ = (Index("ix_idempotencia_fecha_creado", "fecha_creado"),)
+    usuario_id: Mapped[int] = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    clave: Mapped[str] = Column(String(256), primary_key=True)
+    ruta: Mapped[str] = Column(String(256))
+    respuesta: Mapped[str | None] = Column(Text)
+    fecha_creado: Mapped[datetime] = Column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
 class Factura(Base):
     __tablename__ = 'factura'
+    __table_args__ = (Index("ix_factura_punto_id_fecha", "punto_id", "fecha"),)
     id: Mapped[int] = Column(Integer, primary_key=True)
-    monto: Mapped[float] = Column(Float(2))
-    ventas: Mapped[str] = Column(String(2048))
+    monto: Mapped[float] = Column(DINERO)
+    ventas: Mapped[str] = Column(Text)
     fecha: Mapped[datetime] = Column(DateTime)
     pago_electronico: Mapped[bool] = Column(Boolean)
     no_operacion: Mapped[str | None] = Column(String(256))
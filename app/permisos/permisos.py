@@ -0,0 +1,88 @@
+import os
+from datetime import date
+from typing import Annotated
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
+from ..database.database import get_db
+from ..models import models
+from ..auth import auth
+from ..cache import cache
+
+# negocios y puntos a los que llega cada usuario, con la licencia de cada negocio
+# se cargan en una consulta y se guardan unos segundos, los routers verifican en memoria
+alcance_cache = cache.TTLCache(maxsize=int(os.getenv("ALCANCE_CACHE_SIZE", "1024")),
+                               ttl=float(os.getenv("ALCANCE_CACHE_TTL", "30")))
+
+
+class Alcance:
+    """Negocios ({id: fecha_licencia}) y puntos ({id: negocio_id}) de un usuario."""
+
+    def __init__(self, licencias: dict, puntos: dict):
+        self.licencias = licencias
+        self.puntos = puntos
+
+    def negocio(self, negocio_id: int | None):
+
+        # el negocio es del usuario y su licencia esta vigente
+        licencia = self.licencias.get(negocio_id)
+        return licencia is not None and licencia >= date.today()
+
+    def punto(self, punto_id: int | None):
+
+        return self.negocio(self.puntos.get(punto_id))
+
+    async def inventario(self, session: AsyncSession, inventario_id: int | None):
+
+        # busqueda por llave primaria, si el inventario ya esta en la sesion no consulta la base de datos
+        inventariodb = await session.get(models.Inventario, inventario_id) if inventario_id is not None else None
+        return inventariodb is not None and self.negocio(inventariodb.negocio_id)
+
+    async def distribucion(self, session: AsyncSession, distribucion_id: int, punto_id: int):
+
+        # el punto es del usuario y la distribucion es de un inventario del mismo negocio
+        if not self.punto(punto_id):
+            return False
+
+        negocio_id = await session.scalar(db.select(models.Inventario.negocio_id)\
+            .join(models.Distribucion, models.Distribucion.inventario_id == models.Inventario.id)\
+            .where(models.Distribucion.id == distribucion_id))
+
+        return negocio_id == self.puntos[punto_id]
+
+
+async def cargar(session: AsyncSession, user: models.User):
+
+    if user.rol == "propietario":
+        condicion = models.Negocio.propietario_id == user.id
+    elif user.rol == "dependiente" and user.punto_id is not None:
+        condicion = models.Punto.id == user.punto_id
+    else:
+        return Alcance({}, {})
+
+    rows = (await session.execute(db.select(models.Negocio.id, models.Negocio.fecha_licencia, models.Punto.id)\
+        .outerjoin(models.Punto, models.Punto.negocio_id == models.Negocio.id)\
+        .where(condicion)))\
+        .all()
+
+    return Alcance({row[0]: row[1] for row in rows},
+                   {row[2]: row[0] for row in rows if row[2] is not None})
+
+
+async def get_alcance(current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
+
+    # el punto forma parte de la clave, un dependiente movido de punto no usa el alcance anterior
+    clave = (current_user.id, current_user.rol, current_user.punto_id)
+
+    alcance = alcance_cache.get(clave)
+    if alcance is None:
+        alcance = await cargar(session, current_user)
+        alcance_cache.set(clave, alcance)
+
+    return alcance
+
+
+def invalidar():
+
+    # negocios y puntos cambian poco, se descarta todo al crearlos, editarlos o eliminarlos
+    alcance_cache.clear()
@@ -0,0 +1,32 @@
+from decimal import Decimal
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# respuestas json serializadas con orjson
+# los listados seleccionan columnas con etiqueta y devuelven las filas como dicts en una RespuestaJSON,
+# FastAPI no vuelve a validarlas con el response_model ni a recorrerlas con jsonable_encoder
+# comparar el costo por fila: python -m tools.bench.respuesta [filas]
+
+
+def _valor(valor):
+
+    # Decimal como float, igual que las columnas numeric de los modelos
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return jsonable_encoder(valor)
+
+
+class RespuestaJSON(JSONResponse):
+
+    def render(self, content) -> bytes:
+        # orjson serializa fechas, uuid y numeros, lo demas (Decimal, modelos) pasa por _valor
+        return orjson.dumps(content, default=_valor, option=orjson.OPT_NON_STR_KEYS)
+
+
+def filas(result):
+
+    # un dict por fila, las claves son las etiquetas de las columnas del select
+    columnas = list(result.keys())
+    return [dict(zip(columnas, row)) for row in result]
+
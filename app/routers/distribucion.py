@@ -1,48 +1,36 @@
-from cgitb import reset
-from xml.parsers.expat import model
 from fastapi import APIRouter, status, HTTPException, Depends
-from typing import List, Annotated
-from sqlalchemy.orm import Session
+from typing import List, Annotated, Literal
+from sqlalchemy.ext.asyncio import AsyncSession
 import sqlalchemy as db
-from ..database.database import Base, engine
+from ..database.database import get_db, get_db_lectura
 from ..schemas import distribucion
 from .. models import models
 from ..auth import auth
+from ..cache import cache
+from ..permisos import permisos
 from ..log import log
+from ..existencia import existencia
+from ..venta_diaria import venta_diaria
+from ..exportar import exportar
+from ..cuadre import cuadre
+from ..respuesta import respuesta
 from datetime import date
+from ..fecha import fecha
 
-# Create the database
-Base.metadata.create_all(engine)
 
 router = APIRouter()
 
 
 @router.post("/distribucion", response_model=distribucion.Distribucion, status_code=status.HTTP_201_CREATED, tags=["distribucion"])
-async def create_distribucion(distribucion: distribucion.DistribucionCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def create_distribucion(distribucion: distribucion.DistribucionCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    # verificar si usuario autenticado es propietario del negocio buscando por punto
-    prop_negocio = session.query(models.Punto)\
-        .join(models.Negocio)\
-        .where(models.Punto.id == distribucion.punto_id,
-               models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-        .count()
-
-    # verificar si usuario autenticado es propietario del inventario
-    prop_inventario = session.query(models.Inventario)\
-        .join(models.Negocio)\
-        .where(models.Inventario.id == distribucion.inventario_id,
-               models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-        .count()
-
-    if not prop_negocio or not prop_inventario:
+    # verificar si usuario autenticado es propietario del punto y del inventario
+    if not alcance.punto(distribucion.punto_id) or not await alcance.inventario(session, distribucion.inventario_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
@@ -53,46 +41,51 @@ async def create_distribucion(distribucion: distribucion.DistribucionCreate, tok
 
     # add it to the session and commit it
     session.add(distribuciondb)
-    session.commit()
-    session.refresh(distribuciondb)
+    await session.flush()
+
+    # la cantidad distribuida pasa del almacen al punto
+    await existencia.crear(session, distribuciondb.id, distribuciondb.cantidad)
+    await existencia.ajustar_almacen(session, {distribuciondb.inventario_id: -distribuciondb.cantidad})
 
-    log.create_log({
+    await session.commit()
+    await cache.invalidar_puntos(session, distribucion.punto_id)
+    await session.refresh(distribuciondb)
+
+    await log.create_log({
         "usuario": current_user.usuario,
         "accion": "CREATE",
         "tabla": "Distribucion",
         "descripcion": f"Ha creado el id {distribuciondb.id}"
     })
 
-    # close the session
-    session.close()
-
     # return the distribucion object
     return distribuciondb
 
 
 @router.get("/distribucion/{id}",response_model=distribucion.DistribucionGet, tags=["distribucion"])
-async def read_distribucion(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_distribucion(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the distribucion item with the given id
-    distribuciondb: distribucion.Distribucion = session.query(
+    distribuciondb: distribucion.Distribucion = (await session.execute(db.select(
         models.Distribucion.id, models.Distribucion.cantidad, models.Distribucion.fecha,
         models.Distribucion.inventario_id, models.Distribucion.punto_id,
         models.Inventario.negocio_id, models.Inventario.cantidad)\
         .join(models.Inventario)\
-        .where(models.Distribucion.id == id)\
+        .where(models.Distribucion.id == id)))\
         .first()
 
-    cantidad_distribuida = session.query(db.func.sum(models.Distribucion.cantidad).label("cantidad_distribuida"))\
+    if not distribuciondb:
+        raise HTTPException(
+            status_code=404, detail=f"Distribución con id {id} no encontrada")
+
+    cantidad_distribuida = (await session.execute(db.select(db.func.sum(models.Distribucion.cantidad).label("cantidad_distribuida"))\
         .where(models.Distribucion.inventario_id == distribuciondb[3])\
-        .group_by(models.Distribucion.inventario_id)\
+        .group_by(models.Distribucion.inventario_id)))\
         .first()
 
     resultdb: dict = {
@@ -109,129 +102,103 @@ async def read_distribucion(id: int, token: Annotated[str, Depends(auth.oauth2_s
     # verificar si usuario autenticado es propietario del negocio
     if distribuciondb:
         # verificar si usuario autenticado es propietario del negocio buscando por punto
-        prop_negocio = session.query(models.Punto)\
+        prop_negocio = await session.scalar(db.select(db.func.count()).select_from(models.Punto)\
             .join(models.Negocio)\
             .where(models.Punto.id == resultdb.get("punto_id"),
-                   models.Negocio.propietario_id == current_user.id)\
-            .count()
+                   models.Negocio.propietario_id == current_user.id))
 
         # verificar si usuario autenticado es propietario del inventario
-        prop_inventario = session.query(models.Inventario)\
+        prop_inventario = await session.scalar(db.select(db.func.count()).select_from(models.Inventario)\
             .join(models.Negocio)\
             .where(models.Inventario.id == resultdb.get("inventario_id"),
-                   models.Negocio.propietario_id == current_user.id)\
-            .count()
+                   models.Negocio.propietario_id == current_user.id))
 
         if not prop_negocio or not prop_inventario:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
-    # close the session
-    session.close()
-
-    if not distribuciondb:
-        raise HTTPException(
-            status_code=404, detail=f"Distribución con id {id} no encontrada")
-
     return resultdb
 
 
 @router.put("/distribucion/{id}", tags=["distribucion"])
-async def update_distribucion(id: int, distribucion: distribucion.DistribucionCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_distribucion(id: int, distribucion: distribucion.DistribucionCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the producto item with the given id
-    distribuciondb: distribucion.Distribucion = session.query(
-        models.Distribucion).get(id)
+    distribuciondb: distribucion.Distribucion = await session.get(models.Distribucion, id)
 
     # verificar si usuario autenticado es propietario del negocio
     if distribuciondb:
-        # verificar si usuario autenticado es propietario del negocio buscando por punto
-        prop_negocio = session.query(models.Punto)\
-            .join(models.Negocio)\
-            .where(models.Punto.id == distribucion.punto_id,
-                   models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        # verificar si usuario autenticado es propietario del inventario
-        prop_inventario = session.query(models.Inventario)\
-            .join(models.Negocio)\
-            .where(models.Inventario.id == distribucion.inventario_id,
-                   models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        if not prop_negocio or not prop_inventario:
+        # verificar si usuario autenticado es propietario del punto y del inventario, anteriores y nuevos
+        if not alcance.punto(distribuciondb.punto_id) or not alcance.punto(distribucion.punto_id) or \
+                not await alcance.inventario(session, distribucion.inventario_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
     # update distribucion item with the given task (if an item with the given id was found)
     if distribuciondb:
+        # ajustar las existencias del punto y del almacen con la diferencia
+        await existencia.ajustar(session, {distribuciondb.id: distribucion.cantidad - distribuciondb.cantidad})
+        almacen = {distribuciondb.inventario_id: distribuciondb.cantidad}
+        almacen[distribucion.inventario_id] = almacen.get(distribucion.inventario_id, 0) - distribucion.cantidad
+        await existencia.ajustar_almacen(session, almacen)
+
+        # las ventas ya hechas se acumulan con el producto del nuevo inventario
+        reacumular = distribucion.inventario_id != distribuciondb.inventario_id
+        if reacumular:
+            await venta_diaria.restar(session, models.Venta.distribucion_id == distribuciondb.id)
+
+        punto_anterior = distribuciondb.punto_id
         distribuciondb.inventario_id = distribucion.inventario_id
         distribuciondb.cantidad = distribucion.cantidad
         distribuciondb.fecha = distribucion.fecha
         distribuciondb.punto_id = distribucion.punto_id
-        session.commit()
+        if reacumular:
+            await venta_diaria.sumar(session, models.Venta.distribucion_id == distribuciondb.id)
+        await session.commit()
+        await cache.invalidar_puntos(session, punto_anterior, distribucion.punto_id)
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "UPDATE",
             "tabla": "Distribucion",
             "descripcion": f"Ha editado el id {distribuciondb.id}"
         })
 
-    # close the session
-    session.close()
-
 
 @router.delete("/distribucion/{id}", status_code=status.HTTP_204_NO_CONTENT, tags=["distribucion"])
-async def delete_distribucion(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def delete_distribucion(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the distribucion item with the given id
-    distribuciondb: models.Inventario = session.query(
-        models.Distribucion).get(id)
+    distribuciondb: models.Inventario = await session.get(models.Distribucion, id)
 
     # verificar si usuario autenticado es propietario del negocio
     if distribuciondb:
-        # verificar si usuario autenticado es propietario del negocio buscando por punto
-        prop_negocio = session.query(models.Punto)\
-            .join(models.Negocio)\
-            .where(models.Punto.id == distribuciondb.punto_id,
-                   models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        # verificar si usuario autenticado es propietario del inventario
-        prop_inventario = session.query(models.Inventario)\
-            .join(models.Negocio)\
-            .where(models.Inventario.id == distribuciondb.inventario_id,
-                   models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        if not prop_negocio or not prop_inventario:
+        # verificar si usuario autenticado es propietario del punto y del inventario
+        if not alcance.punto(distribuciondb.punto_id) or not await alcance.inventario(session, distribuciondb.inventario_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
     # if distribucion item with given id exists, delete it from the database. Otherwise raise 404 error
     if distribuciondb:
-        session.delete(distribuciondb)
-        session.commit()
-        session.close()
-
-        log.create_log({
+        # la cantidad vuelve al almacen, la existencia del punto se elimina con la distribucion
+        # las ventas se eliminan en cascada con la distribucion, se restan antes del acumulado diario
+        await existencia.ajustar_almacen(session, {distribuciondb.inventario_id: distribuciondb.cantidad})
+        await venta_diaria.restar(session, models.Venta.distribucion_id == distribuciondb.id)
+        await session.delete(distribuciondb)
+        await session.commit()
+        await cache.invalidar_puntos(session, distribuciondb.punto_id)
+
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "DELETE",
             "tabla": "Distribucion",
@@ -245,20 +212,17 @@ async def delete_distribucion(id: int, token: Annotated[str, Depends(auth.oauth2
 
 
 @router.get("/distribuciones/", tags=["distribuciones"], description="Listado de distribuciones")
-async def read_distribuciones_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_distribuciones_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the distribuciones item with the given id
-    distribucionesdb = session.query(models.Distribucion.id, models.Distribucion.cantidad,
-                                     models.Distribucion.fecha, models.Punto.nombre,
-                                     models.Negocio.nombre, models.Producto.nombre,
+    distribucionesdb = await session.execute(db.select(models.Distribucion.id, models.Distribucion.cantidad,
+                                     models.Distribucion.fecha, models.Punto.nombre.label("punto_id"),
+                                     models.Negocio.nombre.label("negocio_id"), models.Producto.nombre.label("producto_id"),
                                      models.Inventario.costo)\
         .select_from(models.Distribucion)\
         .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
@@ -267,42 +231,49 @@ async def read_distribuciones_propietario(token: Annotated[str, Depends(auth.oau
         .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
         .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
         .where(models.User.usuario.like(current_user.usuario))\
-        .order_by(models.Distribucion.fecha.desc(), models.Producto.nombre)\
-        .all()
-
-    resultdb = []
-    for row in distribucionesdb:
-        resultdb.append({
-            "id": row[0],
-            "cantidad": row[1],
-            "fecha": row[2],
-            "punto_id": row[3],
-            "negocio_id": row[4],
-            "producto_id": row[5],
-            "costo": row[6],
-        })
+        .order_by(models.Distribucion.fecha.desc(), models.Producto.nombre))
 
-    session.close()
-    return resultdb
+    return respuesta.RespuestaJSON(respuesta.filas(distribucionesdb))
 
 
-@router.get("/distribuciones-venta/", tags=["distribuciones"], description="Distribuciones disponibles para la venta, restando cantidad vendida")
-async def read_distribuciones_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+@router.get("/distribuciones-exportar", tags=["distribuciones"], description="Exportar distribuciones de un propietario en ndjson o csv")
+async def export_distribuciones_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)],
+                                            formato: Literal["ndjson", "csv"] = "ndjson"):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+    stmt = db.select(models.Distribucion.id, models.Distribucion.fecha, models.Producto.nombre, models.Punto.nombre,
+                     models.Negocio.nombre, models.Distribucion.cantidad, models.Inventario.costo)\
+        .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
+        .where(models.Negocio.propietario_id == current_user.id)\
+        .order_by(models.Distribucion.fecha, models.Distribucion.id)
+
+    return exportar.exportar(stmt, ["id", "fecha", "nombre_producto", "nombre_punto", "nombre_negocio", "cantidad",
+                                    "costo"], formato, "distribuciones")
+
+
+@router.get("/distribuciones-venta/", tags=["distribuciones"], description="Distribuciones disponibles para la venta, restando cantidad vendida")
+async def read_distribuciones_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "propietario":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
 
     # get the distribuciones item with the given id
-    distribucionesdb = session.query(models.Distribucion.id, models.Distribucion.cantidad,
-                                     models.Distribucion.fecha, models.Punto.id,
-                                     models.Producto.nombre, models.Inventario.precio_venta,
-                                     db.func.sum(db.func.coalesce(models.Venta.cantidad,0)),
-                                     models.Punto.nombre, models.Inventario.um, models.Distribucion.fecha)\
+    vendida = db.func.sum(db.func.coalesce(models.Venta.cantidad,0))
+    distribucionesdb = await session.execute(db.select(models.Distribucion.id, models.Distribucion.cantidad,
+                                     models.Distribucion.fecha, models.Punto.id.label("punto_id"),
+                                     models.Producto.nombre.label("nombre_producto"), models.Inventario.precio_venta,
+                                     vendida.label("cantidad_vendida"),
+                                     models.Punto.nombre.label("nombre_punto"), models.Inventario.um,
+                                     (models.Distribucion.cantidad - vendida).label("existencia"))\
         .select_from(models.Distribucion)\
         .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
         .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
@@ -315,109 +286,34 @@ async def read_distribuciones_propietario(token: Annotated[str, Depends(auth.oau
          models.Venta.distribucion_id, models.Distribucion.id, 
                 models.Punto.id, models.Producto.nombre, models.Inventario.negocio_id,
                 models.Inventario.precio_venta, models.Inventario.um)\
-        .order_by(models.Inventario.negocio_id, models.Distribucion.punto_id, models.Producto.nombre)\
-        .all()
-
-    resultdb = []
-    for row in distribucionesdb:
-        if row[1] - row[6]:
-            resultdb.append({
-                "id": row[0],
-                "cantidad": row[1],
-                "fecha": row[2],
-                "punto_id": row[3],
-                "nombre_producto": row[4],
-                "precio_venta": row[5],
-                "cantidad_vendida": row[6],
-                "nombre_punto": row[7],
-                "um": row[8],
-                "fecha": row[9],
-                "existencia": row[1] - row[6]
-            })
-            
-    session.close()
-    return resultdb
+        .having(models.Distribucion.cantidad - vendida != 0)\
+        .order_by(models.Inventario.negocio_id, models.Distribucion.punto_id, models.Producto.nombre))
+
+    return respuesta.RespuestaJSON(respuesta.filas(distribucionesdb))
 
 
 @router.get("/distribuciones-venta-resumen/{punto}", tags=["distribuciones"], description="Distribuciones disponibles para la venta, restando cantidad vendida")
-async def read_distribuciones_resumen_propietario(punto: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_distribuciones_resumen_propietario(punto: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+    # respuesta guardada mientras no cambien los negocios del propietario
+    clave, resultdb = await cache.leer(session, "distribuciones-venta-resumen", current_user.id, punto)
+    if resultdb is not None:
+        return respuesta.RespuestaJSON(resultdb)
 
-    # get the distribuciones item with the given id
-    distribucionesdb = session.query(db.func.row_number().over(),models.Producto.nombre,
-                                     db.func.sum(models.Distribucion.cantidad), models.Punto.nombre,
-                                     models.Inventario.um, models.Inventario.precio_venta)\
-        .select_from(models.Distribucion)\
-        .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Punto.id == punto)\
-        .group_by(models.Producto.nombre, models.Punto.nombre, models.Inventario.um, models.Inventario.precio_venta)\
-        .order_by(models.Punto.nombre, models.Producto.nombre)\
-        .all()
-
-    resultdbdistribucion = {}
-    for row in distribucionesdb:
-            resultdbdistribucion[row[1]]={
-                "id": row[0],
-                "nombre_producto": row[1],
-                "cantidad_distribuida": row[2],
-                "nombre_punto": row[3],
-                "um": row[4],
-                "precio_venta": row[5],
-            }
-            
-     # get the negocio item with the given id
-    ventasdb = session.query(models.Producto.nombre,
-                             models.Punto.nombre, db.func.sum(models.Venta.cantidad),
-                             db.func.row_number().over())\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Punto.id == punto)\
-        .group_by(models.Producto.nombre, models.Punto.nombre)\
-        .order_by(db.func.sum(models.Venta.cantidad).desc())\
-        .all()
-
-    resultdbventas = {}
-    for row in ventasdb:
-        resultdbventas[row[0]] = {
-            "nombre_producto": row[0],
-            "nombre_punto": row[1],
-            "cantidad_vendida": row[2],
-            "id": row[3],
-        }
-
-    resultdb=[]
-    for key, value in resultdbdistribucion.items():
-        if resultdbventas.get(key):
-            resultdbdistribucion.get(key).update({"cantidad_vendida": resultdbventas.get(key).get("cantidad_vendida")})
-        else:
-            resultdbdistribucion.get(key).update({"cantidad_vendida":0})
-
-        resultdbdistribucion.get(key).update({"existencia": resultdbdistribucion.get(key).get("cantidad_distribuida") - resultdbdistribucion.get(key).get("cantidad_vendida")})
-       
-        if resultdbdistribucion.get(key).get("existencia") > 0:
-            resultdb.append(value)  
-
-
-    session.close()
-    return resultdb
+    # existencia del punto por producto
+    resultdb = await cuadre.resumen(session, [models.Negocio.propietario_id == current_user.id, models.Punto.id == punto])
+    await cache.guardar(clave, resultdb)
+
+    return respuesta.RespuestaJSON(resultdb)
 
 
 @router.get("/distribuciones-periodo/{fecha_inicio}/{fecha_fin}", tags=["distribuciones"], description="Listado de distribuciones por fecha, agrupadas por inventario")
-async def read_distribuciones_propietario(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_distribuciones_propietario(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db_lectura)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
@@ -429,13 +325,11 @@ async def read_distribuciones_propietario(fecha_inicio: date, fecha_fin: date, t
         raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
                             detail=f"La fecha fin debe ser mayor que la fecha inicio")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the distribuciones item with the given id
-    distribucionesdb = session.query(db.func.row_number().over(), db.func.sum(models.Distribucion.cantidad),
-                                     models.Punto.nombre, models.Negocio.nombre, 
-                                     models.Producto.nombre)\
+    distribucionesdb = await session.execute(db.select(db.func.row_number().over().label("id"),
+                                     db.func.sum(models.Distribucion.cantidad).label("cantidad"),
+                                     models.Punto.nombre.label("nombre_punto"), models.Negocio.nombre.label("nombre_negocio"),
+                                     models.Producto.nombre.label("nombre_producto"))\
         .select_from(models.Distribucion)\
         .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
         .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
@@ -443,42 +337,29 @@ async def read_distribuciones_propietario(fecha_inicio: date, fecha_fin: date, t
         .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
         .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
         .where(models.User.usuario.like(current_user.usuario),
-                db.func.date(models.Distribucion.fecha) >= fecha_inicio, db.func.date(models.Distribucion.fecha) <= fecha_fin)\
+                fecha.rango(models.Distribucion.fecha, fecha_inicio, fecha_fin))\
         .group_by(models.Distribucion.punto_id, models.Producto.nombre, models.Negocio.nombre, models.Punto.nombre)\
-        .order_by(db.func.sum(models.Distribucion.cantidad).desc(), models.Producto.nombre)\
-        .all()
-
-    resultdb = []
-    for row in distribucionesdb:
-        resultdb.append({
-            "id": row[0],
-            "cantidad": row[1],
-            "nombre_punto": row[2],
-            "nombre_negocio": row[3],
-            "nombre_producto": row[4],
-        })
+        .order_by(db.func.sum(models.Distribucion.cantidad).desc(), models.Producto.nombre))
 
-    session.close()
-    return resultdb
+    return respuesta.RespuestaJSON(respuesta.filas(distribucionesdb))
 
 
 @router.get("/distribuciones-venta-punto/", tags=["distribuciones"], description="Distribuciones disponibles para la venta, restando cantidad vendida")
-async def read_distribuciones_dependiente(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_distribuciones_dependiente(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the distribuciones item with the given id
-    distribucionesdb = session.query(models.Distribucion.id, models.Distribucion.cantidad,
-                                     models.Distribucion.fecha, models.Punto.id,
-                                     models.Producto.nombre, models.Inventario.precio_venta,
-                                     db.func.sum(db.func.coalesce(models.Venta.cantidad,0)),
-                                     models.Punto.nombre, models.Inventario.um)\
+    vendida = db.func.sum(db.func.coalesce(models.Venta.cantidad,0))
+    distribucionesdb = await session.execute(db.select(models.Distribucion.id, models.Distribucion.cantidad,
+                                     models.Distribucion.fecha, models.Punto.id.label("punto_id"),
+                                     models.Producto.nombre.label("nombre_producto"), models.Inventario.precio_venta,
+                                     vendida.label("cantidad_vendida"),
+                                     models.Punto.nombre.label("nombre_punto"), models.Inventario.um,
+                                     (models.Distribucion.cantidad - vendida).label("existencia"))\
         .select_from(models.Distribucion)\
         .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
         .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
@@ -491,362 +372,67 @@ async def read_distribuciones_dependiente(token: Annotated[str, Depends(auth.oau
          models.Venta.distribucion_id, models.Distribucion.id, 
                 models.Punto.id, models.Producto.nombre, models.Inventario.negocio_id,
                 models.Inventario.precio_venta, models.Inventario.um)\
-        .order_by(models.Producto.nombre)\
-        .all()
-
-    resultdb = []
-    for row in distribucionesdb:
-        if row[1] - row[6]:
-            resultdb.append({
-                "id": row[0],
-                "cantidad": row[1],
-                "fecha": row[2],
-                "punto_id": row[3],
-                "nombre_producto": row[4],
-                "precio_venta": row[5],
-                "cantidad_vendida": row[6],
-                "nombre_punto": row[7],
-                "um": row[8],
-                "existencia": row[1] - row[6]
-            })
-
-    session.close()
-    return resultdb
+        .having(models.Distribucion.cantidad - vendida != 0)\
+        .order_by(models.Producto.nombre))
+
+    return respuesta.RespuestaJSON(respuesta.filas(distribucionesdb))
 
 
 @router.get("/distribuciones-venta-punto-existencia/", tags=["distribuciones"], description="Distribuciones disponibles para la venta, restando cantidad vendida")
-async def read_distribuciones_dependiente(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_distribuciones_dependiente(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    # get the distribuciones item with the given id
-    distribucionesdb = session.query(db.func.row_number().over(),models.Producto.nombre,
-                                     db.func.sum(models.Distribucion.cantidad), models.Punto.nombre,
-                                     models.Inventario.um, models.Inventario.precio_venta)\
-        .select_from(models.Distribucion)\
-        .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .where(models.Punto.id == current_user.punto_id)\
-        .group_by(models.Producto.nombre, models.Punto.nombre, models.Inventario.um, models.Inventario.precio_venta)\
-        .order_by(models.Punto.nombre, models.Producto.nombre)\
-        .all()
-
-    resultdbdistribucion = {}
-    for row in distribucionesdb:
-            resultdbdistribucion[row[1]]={
-                "id": row[0],
-                "nombre_producto": row[1],
-                "cantidad_distribuida": row[2],
-                "nombre_punto": row[3],
-                "um": row[4],
-                "precio_venta": row[5],
-            }
-            
-     # get the negocio item with the given id
-    ventasdb = session.query(models.Producto.nombre,
-                             models.Punto.nombre, db.func.sum(models.Venta.cantidad),
-                             db.func.row_number().over())\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Punto.id == current_user.punto_id)\
-        .group_by(models.Producto.nombre, models.Punto.nombre)\
-        .order_by(db.func.sum(models.Venta.cantidad).desc())\
-        .all()
-
-    resultdbventas = {}
-    for row in ventasdb:
-        resultdbventas[row[0]] = {
-            "nombre_producto": row[0],
-            "nombre_punto": row[1],
-            "cantidad_vendida": row[2],
-            "id": row[3],
-        }
-
-    resultdb=[]
-    for key, value in resultdbdistribucion.items():
-        if resultdbventas.get(key):
-            resultdbdistribucion.get(key).update({"cantidad_vendida": resultdbventas.get(key).get("cantidad_vendida")})
-        else:
-            resultdbdistribucion.get(key).update({"cantidad_vendida":0})
-
-        resultdbdistribucion.get(key).update({"existencia": resultdbdistribucion.get(key).get("cantidad_distribuida") - resultdbdistribucion.get(key).get("cantidad_vendida")})
-        
-        if resultdbdistribucion.get(key).get("existencia") > 0:
-            resultdb.append(value)  
-
-
-    session.close()
-    return resultdb
+    # existencia del punto por producto
+    return respuesta.RespuestaJSON(await cuadre.resumen(session, [models.Punto.id == current_user.punto_id]))
 
 
 @router.get("/distribuciones-contador/{fecha_inicio}/{fecha_fin}", tags=["admin"], description="Contador de distribuciones")
-async def read_count_distribuciones(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_count_distribuciones(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the distribuciones item with the given id
-    contadorDistribuciones = session.query(models.Distribucion).count()
+    contadorDistribuciones = await session.scalar(db.select(db.func.count()).select_from(models.Distribucion))
 
-    contadorDistribucionesFecha = session.query(models.Distribucion)\
-                                .where(models.Distribucion.fecha_creado >= fecha_inicio, models.Distribucion.fecha_creado <= fecha_fin)\
-                                .count()
+    contadorDistribucionesFecha = await session.scalar(db.select(db.func.count()).select_from(models.Distribucion)\
+                                .where(fecha.rango(models.Distribucion.fecha_creado, fecha_inicio, fecha_fin)))
 
-    # close the session
-    session.close()
-    
     return {"cantidad_distribuciones": contadorDistribuciones, "nuevas_distribuciones":contadorDistribucionesFecha }
 
 
 @router.get("/distribuciones-venta-cuadre/{fecha_inicio}/{fecha_fin}/{punto}", tags=["distribuciones"], description="Cuadre propietario")
-async def read_distribuciones_cuadre_propietario(fecha_inicio: date, fecha_fin: date, punto: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_distribuciones_cuadre_propietario(fecha_inicio: date, fecha_fin: date, punto: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db_lectura)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    # get the distribuciones item with the given id
-    distribucionesdb = session.query(db.func.row_number().over(),models.Producto.nombre,
-                                     db.func.sum(models.Distribucion.cantidad), models.Punto.nombre,
-                                     models.Inventario.um, models.Inventario.precio_venta)\
-        .select_from(models.Distribucion)\
-        .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Punto.id == punto)\
-        .group_by(models.Producto.nombre, models.Punto.nombre, models.Inventario.um, models.Inventario.precio_venta)\
-        .order_by(models.Punto.nombre, models.Producto.nombre)\
-        .all()
-
-    resultdbdistribucion = {}
-    for row in distribucionesdb:
-            resultdbdistribucion[row[1]]={
-                "id": row[0],
-                "nombre_producto": row[1],
-                "cantidad_distribuida": row[2],
-                "nombre_punto": row[3],
-                "um": row[4],
-                "precio_venta": row[5],
-            }
-            
-    # get the negocio item with the given id
-    ventasdb = session.query(models.Producto.nombre,
-                             models.Punto.nombre, db.func.sum(models.Venta.cantidad),
-                             db.func.row_number().over(), db.func.sum(models.Venta.monto))\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Punto.id == punto,
-                db.func.date(models.Venta.fecha) >= fecha_inicio, db.func.date(models.Venta.fecha) <= fecha_fin)\
-        .group_by(models.Producto.nombre, models.Punto.nombre)\
-        .order_by(db.func.sum(models.Venta.cantidad).desc())\
-        .all()
-
-    resultdbventas = {}
-    for row in ventasdb:
-        resultdbventas[row[0]] = {
-            "nombre_producto": row[0],
-            "nombre_punto": row[1],
-            "cantidad_vendida": row[2],
-            "id": row[3],
-            "monto": row[4],
-        }
-        
-
-    # get the negocio item with the given id
-    ventastotalesdb = session.query(models.Producto.nombre,
-                             models.Punto.nombre, db.func.sum(models.Venta.cantidad),
-                             db.func.row_number().over(), db.func.sum(models.Venta.monto))\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Punto.id == punto)\
-        .group_by(models.Producto.nombre, models.Punto.nombre)\
-        .order_by(db.func.sum(models.Venta.cantidad).desc())\
-        .all()
-
-    resulttotalesdbventas = {}
-    for row in ventastotalesdb:
-        resulttotalesdbventas[row[0]] = {
-            "nombre_producto": row[0],
-            "nombre_punto": row[1],
-            "cantidad_vendida": row[2],
-            "id": row[3],
-            "monto": row[4],
-        }
-
-    resultdb=[]
-    for key, value in resultdbdistribucion.items():
-        if resultdbventas.get(key):
-            resultdbdistribucion.get(key).update({"cantidad_vendida": resultdbventas.get(key).get("cantidad_vendida")})
-            resultdbdistribucion.get(key).update({"monto": resultdbventas.get(key).get("monto")})
-        else:
-            resultdbdistribucion.get(key).update({"cantidad_vendida":0})
-            resultdbdistribucion.get(key).update({"monto":0})
-
-        if resulttotalesdbventas.get(key):
-            resultdbdistribucion.get(key).update({"existencia": resultdbdistribucion.get(key).get("cantidad_distribuida") - resulttotalesdbventas.get(key).get("cantidad_vendida")})
-        else:
-            resultdbdistribucion.get(key).update({"existencia": resultdbdistribucion.get(key).get("cantidad_distribuida")})
-
-        if resultdbdistribucion.get(key).get("existencia") > 0 or resultdbdistribucion.get(key).get("cantidad_vendida") > 0:
-            resultdb.append(value)  
-
-
-    session.close()
-    return resultdb
+    # cuadre del punto por producto en el periodo
+    return respuesta.RespuestaJSON(await cuadre.cuadre(session, [models.Negocio.propietario_id == current_user.id, models.Punto.id == punto],
+                                                       fecha_inicio, fecha_fin))
 
 
 @router.get("/distribuciones-venta-cuadre-dependiente/{fecha_inicio}/{fecha_fin}", tags=["distribuciones"], description="Cuadre dependiente")
-async def read_distribuciones_cuadre_dependiente(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_distribuciones_cuadre_dependiente(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db_lectura)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    # get the distribuciones item with the given id
-    distribucionesdb = session.query(db.func.row_number().over(),models.Producto.nombre,
-                                     db.func.sum(models.Distribucion.cantidad), models.Punto.nombre,
-                                     models.Inventario.um, models.Inventario.precio_venta)\
-        .select_from(models.Distribucion)\
-        .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .where(models.Punto.id == current_user.punto_id)\
-        .group_by(models.Producto.nombre, models.Punto.nombre, models.Inventario.um, models.Inventario.precio_venta)\
-        .order_by(models.Punto.nombre, models.Producto.nombre)\
-        .all()
-
-    resultdbdistribucion = {}
-    for row in distribucionesdb:
-            resultdbdistribucion[row[1]]={
-                "id": row[0],
-                "nombre_producto": row[1],
-                "cantidad_distribuida": row[2],
-                "nombre_punto": row[3],
-                "um": row[4],
-                "precio_venta": row[5],
-            }
-            
-    # get the negocio item with the given id
-    ventasdb = session.query(models.Producto.nombre,
-                             models.Punto.nombre, db.func.sum(models.Venta.cantidad),
-                             db.func.row_number().over(), db.func.sum(models.Venta.monto))\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Punto.id == current_user.punto_id,
-                db.func.date(models.Venta.fecha) >= fecha_inicio, db.func.date(models.Venta.fecha) <= fecha_fin)\
-        .group_by(models.Producto.nombre, models.Punto.nombre)\
-        .order_by(db.func.sum(models.Venta.cantidad).desc())\
-        .all()
-
-    resultdbventas = {}
-    for row in ventasdb:
-        resultdbventas[row[0]] = {
-            "nombre_producto": row[0],
-            "nombre_punto": row[1],
-            "cantidad_vendida": row[2],
-            "id": row[3],
-            "monto": row[4],
-        }
-
-    # get the negocio item with the given id
-    ventastotalesdb = session.query(models.Producto.nombre,
-                             models.Punto.nombre, db.func.sum(models.Venta.cantidad),
-                             db.func.row_number().over(), db.func.sum(models.Venta.monto))\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Punto.id == current_user.punto_id)\
-        .group_by(models.Producto.nombre, models.Punto.nombre)\
-        .order_by(db.func.sum(models.Venta.cantidad).desc())\
-        .all()
-
-    resulttotalesdbventas = {}
-    for row in ventastotalesdb:
-        resulttotalesdbventas[row[0]] = {
-            "nombre_producto": row[0],
-            "nombre_punto": row[1],
-            "cantidad_vendida": row[2],
-            "id": row[3],
-            "monto": row[4],
-        }
-
-    resultdb=[]
-    for key, value in resultdbdistribucion.items():
-        if resultdbventas.get(key):
-            resultdbdistribucion.get(key).update({"cantidad_vendida": resultdbventas.get(key).get("cantidad_vendida")})
-            resultdbdistribucion.get(key).update({"monto": resultdbventas.get(key).get("monto")})
-        else:
-            resultdbdistribucion.get(key).update({"cantidad_vendida":0})
-            resultdbdistribucion.get(key).update({"monto":0})
-
-        if resulttotalesdbventas.get(key):
-            resultdbdistribucion.get(key).update({"existencia": resultdbdistribucion.get(key).get("cantidad_distribuida") - resulttotalesdbventas.get(key).get("cantidad_vendida")})
-        else:
-            resultdbdistribucion.get(key).update({"existencia": resultdbdistribucion.get(key).get("cantidad_distribuida")})
-       
-        if resultdbdistribucion.get(key).get("existencia") > 0 or resultdbdistribucion.get(key).get("cantidad_vendida") > 0:
-            resultdb.append(value)  
-
-
-    session.close()
-    return resultdb
+    # cuadre del punto por producto en el periodo
+    return respuesta.RespuestaJSON(await cuadre.cuadre(session, [models.Punto.id == current_user.punto_id], fecha_inicio, fecha_fin))
 
 
-def existencia_distribucion_producto(distribucion_id: int):  
+async def existencia_distribucion_producto(session: AsyncSession, distribucion_id: int):
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    # get the distribuciones item with the given id
-    distribucionesdb = session.query(db.func.sum(models.Distribucion.cantidad), db.func.sum(db.func.coalesce(models.Venta.cantidad,0)))\
-        .select_from(models.Distribucion)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .outerjoin(models.Venta, models.Venta.distribucion_id == models.Distribucion.id)\
-        .where(models.Distribucion.id == distribucion_id)\
-        .group_by(models.Distribucion.inventario_id)\
-        .all()
-            
-    session.close()
-    return {"disponible" : distribucionesdb[0][0] - distribucionesdb[0][1]}
\ No newline at end of file
+    # existencia materializada de la distribucion
+    return {"disponible" : await existencia.disponible(session, distribucion_id)}
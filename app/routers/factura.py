@@ -1,123 +1,163 @@
 import json
 from fastapi import APIRouter, status, HTTPException, Depends
-from typing import List, Annotated
-from sqlalchemy.orm import Session
+from typing import List, Annotated, Literal
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
 from app.schemas.detallesPago import detallesPago
 from app.schemas.pedido import Pedido
-from ..database.database import Base, engine
+from ..database.database import get_db
 from ..models import models
 from ..auth import auth
+from ..cache import cache
+from ..permisos import permisos
 from ..log import log
+from ..existencia import existencia
+from ..venta_diaria import venta_diaria
+from ..idempotencia import idempotencia
+from ..respuesta import respuesta
+from ..exportar import exportar
 from datetime import date
+from ..fecha import fecha
 
 
-# Create the database
-Base.metadata.create_all(engine)
 
 router = APIRouter()
 
 @router.post("/factura", status_code=status.HTTP_201_CREATED, tags=["factura"])
-async def create_factura(carrito: List[Pedido], detallesPago:detallesPago, totalPedido:float, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def create_factura(carrito: List[Pedido], detallesPago:detallesPago, totalPedido:float, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], clave: Annotated[str | None, Depends(idempotencia.get_clave)], session: Annotated[AsyncSession, Depends(get_db)]):
     
     # validando rol de usuario autenticado
     if current_user.rol != "propietario" and current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
     
-    session = Session(bind=engine, expire_on_commit=False)
+    #verificar licencia, el propietario del punto de la factura y el dependiente de su punto
+    # la factura, sus ventas y el acumulado diario se registran en el punto verificado
+    punto_id = detallesPago.punto_id if current_user.rol == "propietario" else current_user.punto_id
 
-    #verificar licencia
-    if current_user.rol == "propietario":
-        negociodb = session.query(models.Negocio)\
-            .join(models.Punto, models.Punto.negocio_id == models.Negocio.id)\
-            .where(models.Negocio.propietario_id == current_user.id, models.Punto.id == detallesPago.punto_id,
-                   models.Negocio.fecha_licencia >= date.today())\
-            .count()
-        
-    if current_user.rol == "dependiente":
-        negociodb = session.query(models.Negocio)\
-            .join(models.Punto, models.Punto.negocio_id == models.Negocio.id)\
-            .where(models.Punto.id == current_user.punto_id,
-                   models.Negocio.fecha_licencia >= date.today())\
-            .count()
-        
-    if not negociodb:
+    if not alcance.punto(punto_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"1No está autorizado a realizar esta acción")
             
-    ventas = []
-     
+    if not carrito:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"El pedido no tiene productos")
+
+    # una repeticion con la misma Idempotency-Key devuelve la factura original sin volver a crearla
+    if clave is not None:
+        anterior = await idempotencia.repetida(session, current_user.id, "/factura", clave)
+        if anterior is not None:
+            return anterior
+
+    # cantidad pedida por distribucion, una misma distribucion puede venir en varias lineas
+    pedido = {}
     for row in carrito:
-        # create an instance of the venta database model
-        ventadb = models.Venta(distribucion_id=row.distribucion_id, cantidad=row.cantidad,
-                            precio=row.precio, fecha=detallesPago.fecha, punto_id=row.punto_id,
-                            usuario_id=current_user.id, monto=row.cantidad * row.precio,
-                            pago_diferido = False, descripcion = None,
-                            pago_electronico = detallesPago.pago_electronico, no_operacion = detallesPago.no_operacion)
-        
-        # add it to the session and commit it
-        session.add(ventadb)
-        session.commit()
-        session.refresh(ventadb)
+        pedido[row.distribucion_id] = pedido.get(row.distribucion_id, 0) + row.cantidad
+
+    # descontar la existencia de todas las lineas en una sola sentencia
+    # solo de distribuciones del negocio del punto de la factura
+    if not await existencia.vender(session, pedido, alcance.puntos[punto_id]):
+        # deshacer lo descontado y buscar el producto que no alcanza
+        await session.rollback()
+        nombre = ""
+        for row in carrito:
+            if not await alcance.distribucion(session, row.distribucion_id, punto_id):
+                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                    detail=f"No está autorizado a realizar esta acción")
+            if await existencia.disponible(session, row.distribucion_id) < pedido[row.distribucion_id]:
+                nombre = row.nombre_producto
+                break
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"El producto {nombre} no está disponible")
+
+    fecha_pago = fecha.naive_utc(detallesPago.fecha)
+
+    facturadb = models.Factura(monto = totalPedido, fecha = fecha_pago,
+                               pago_electronico = detallesPago.pago_electronico, no_operacion = detallesPago.no_operacion,
+                               punto_id= punto_id)
+
+    # obtener el id de la factura para enlazar sus ventas
+    session.add(facturadb)
+    await session.flush()
+
+    # insertar todas las ventas en una sola sentencia y obtener sus id
+    ventas_id = (await session.scalars(db.insert(models.Venta).returning(models.Venta.id, sort_by_parameter_order=True),
+        [{
+            "distribucion_id": row.distribucion_id,
+            "cantidad": row.cantidad,
+            "precio": row.precio,
+            "fecha": fecha_pago,
+            "punto_id": punto_id,
+            "usuario_id": current_user.id,
+            "monto": row.cantidad * row.precio,
+            "pago_diferido": False,
+            "descripcion": None,
+            "pago_electronico": detallesPago.pago_electronico,
+            "no_operacion": detallesPago.no_operacion,
+            "factura_id": facturadb.id,
+        } for row in carrito]))\
+        .all()
+
+    await venta_diaria.sumar(session, models.Venta.factura_id == facturadb.id)
 
+    ventas = []
+
+    for row, venta_id in zip(carrito, ventas_id):
         ventas.append({
             "producto": row.nombre_producto,
             "cantidad": row.cantidad,
             "precio": row.precio,
             "monto": row.precio * row.cantidad,
             "punto": row.nombre_punto,
-            'id': ventadb.id
+            'id': venta_id
         })
 
-        log.create_log({
+        # el log se guarda en la misma transaccion que la venta
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "CREATE",
             "tabla": "Venta",
-            "descripcion": f"Ha creado el id {ventadb.id}"
-        })
+            "descripcion": f"Ha creado el id {venta_id}"
+        }, session)
 
-   
-    facturadb = models.Factura(monto = totalPedido, ventas = json.dumps(ventas), fecha = detallesPago.fecha,
-                               pago_electronico = detallesPago.pago_electronico, no_operacion = detallesPago.no_operacion,
-                               punto_id= detallesPago.punto_id)
-    
-    session.add(facturadb)
-    session.commit()
-    session.refresh(facturadb)
+    # detalle del ticket tal como se vendio
+    facturadb.ventas = json.dumps(ventas)
 
-    
-    # close the session
-    session.close()
+    # la respuesta de la clave es la factura completa, con los valores asignados por la base de datos
+    if clave is not None:
+        await session.flush()
+        await session.refresh(facturadb)
+        guardada = await idempotencia.registrar(session, current_user.id, clave, facturadb)
+
+    # ventas, logs, factura y clave se confirman juntos
+    await session.commit()
+    await cache.invalidar_puntos(session, punto_id)
+    await session.refresh(facturadb)
+
+    if clave is not None:
+        idempotencia.recordar(current_user.id, "/factura", clave, guardada)
 
     # return the venta object
     return facturadb
 
 
 @router.get("/factura/{id}", tags=["factura"], description="Obtener factura")
-async def read_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario" and current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-    
     # get the venta item with the given id
      # get the negocio item with the given id
-    facturadb = session.query(models.Factura.id, models.Factura.monto, models.Factura.pago_electronico,
+    facturadb = (await session.execute(db.select(models.Factura.id, models.Factura.monto, models.Factura.pago_electronico,
                             models.Factura.no_operacion, models.Punto.nombre, models.Factura.ventas, models.Factura.fecha)\
         .join(models.Punto, models.Punto.id == models.Factura.punto_id)\
         .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Factura.id == id)\
+        .where(models.Negocio.propietario_id == current_user.id, models.Factura.id == id)))\
         .first()
 
-    session.close()
-
-    # close the session
-    session.close()
-
     if not facturadb:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Factura con id {id} no encontrada")
@@ -135,96 +175,96 @@ async def read_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)]
 
 
 @router.get("/facturas", tags=["facturas"], description="Listado de facturas")
-async def read_facturas_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_facturas_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario" and current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the negocio item with the given id
     if current_user.rol == "propietario":
-        facturasdb = session.query(models.Factura.id, models.Factura.monto, models.Factura.pago_electronico,
-                                models.Factura.no_operacion, models.Punto.nombre, models.Factura.fecha)\
+        facturasdb = await session.execute(db.select(models.Factura.id, models.Factura.monto, models.Factura.pago_electronico,
+                                models.Factura.no_operacion, models.Punto.nombre.label("nombre_punto"), models.Factura.fecha)\
             .join(models.Punto, models.Punto.id == models.Factura.punto_id)\
             .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
             .where(models.Negocio.propietario_id == current_user.id)\
-            .order_by(models.Factura.fecha.desc())\
-            .all()
+            .order_by(models.Factura.fecha.desc()))
     else:
-        facturasdb = session.query(models.Factura.id, models.Factura.monto, models.Factura.pago_electronico,
-                                models.Factura.no_operacion, models.Punto.nombre, models.Factura.fecha)\
+        facturasdb = await session.execute(db.select(models.Factura.id, models.Factura.monto, models.Factura.pago_electronico,
+                                models.Factura.no_operacion, models.Punto.nombre.label("nombre_punto"), models.Factura.fecha)\
             .join(models.Punto, models.Punto.id == models.Factura.punto_id)\
             .where(models.Punto.id == current_user.punto_id)\
-            .order_by(models.Factura.fecha.desc())\
-            .all()
+            .order_by(models.Factura.fecha.desc()))
 
-    session.close()
+    return respuesta.RespuestaJSON(respuesta.filas(facturasdb))
 
-    resultdb = []
 
-    for row in facturasdb:
-        resultdb.append({
-            "id": row[0],
-            "monto": row[1],
-            "pago_electronico": row[2],
-            "no_operacion": row[3],
-            "nombre_punto": row[4],
-            "fecha": row[5],
-        })
-     
-    return resultdb
+@router.get("/facturas-exportar", tags=["facturas"], description="Exportar facturas de un propietario en ndjson o csv")
+async def export_facturas_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)],
+                                      formato: Literal["ndjson", "csv"] = "ndjson"):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "propietario":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    stmt = db.select(models.Factura.id, models.Factura.fecha, models.Punto.nombre, models.Factura.monto,
+                     models.Factura.pago_electronico, models.Factura.no_operacion)\
+        .join(models.Punto, models.Punto.id == models.Factura.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+        .where(models.Negocio.propietario_id == current_user.id)\
+        .order_by(models.Factura.fecha, models.Factura.id)
+
+    return exportar.exportar(stmt, ["id", "fecha", "nombre_punto", "monto", "pago_electronico", "no_operacion"],
+                             formato, "facturas")
 
 
 @router.delete("/factura/{id}", status_code=status.HTTP_204_NO_CONTENT, tags=["factura"], description="Eliminar factura")
-async def delete_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def delete_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario" and current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the factura item with the given id
-    #ventadb = session.query(models.Venta).get(id)
+    #ventadb = await session.get(models.Venta, id)
 
     if current_user.rol == "propietario":
         # get the venta item with the given id
-        facturadb = session.query(models.Factura)\
+        facturadb = await session.scalar(db.select(models.Factura)\
             .join(models.Punto, models.Punto.id == models.Factura.punto_id)\
             .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-            .where(models.Factura.id == id, models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .first()
+            .where(models.Factura.id == id, models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today()))
 
     if current_user.rol == "dependiente":
-        facturadb = session.query(models.Factura)\
+        facturadb = await session.scalar(db.select(models.Factura)\
             .join(models.Punto, models.Punto.id == models.Factura.punto_id)\
             .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+            .join(models.Venta, models.Venta.factura_id == models.Factura.id)\
             .where(models.Factura.id == id, models.Punto.id == current_user.punto_id, models.Venta.usuario_id == current_user.id,
-                    models.Negocio.fecha_licencia >= date.today())\
-            .first()
+                    models.Negocio.fecha_licencia >= date.today()))
 
     # if todo item with given id exists, delete it from the database. Otherwise raise 404 error
     if facturadb:
 
-        res = json.loads(facturadb.ventas)
-        
-        for row in res:
-            ventadb =  session.query(models.Venta).get(row.get("id"))
-            session.delete(ventadb)
-            session.commit()
+        # devolver a la existencia lo vendido en la factura
+        vendidodb = (await session.execute(db.select(models.Venta.distribucion_id, db.func.sum(models.Venta.cantidad))\
+            .where(models.Venta.factura_id == facturadb.id)\
+            .group_by(models.Venta.distribucion_id)))\
+            .all()
+        await existencia.ajustar(session, {row[0]: row[1] for row in vendidodb})
 
+        await venta_diaria.restar(session, models.Venta.factura_id == facturadb.id)
 
-        session.delete(facturadb)
-        session.commit()
-        session.close()
+        # eliminar las ventas de la factura y la factura en una sola transaccion
+        await session.execute(db.delete(models.Venta).where(models.Venta.factura_id == facturadb.id))
+        await session.delete(facturadb)
+        await session.commit()
+        await cache.invalidar_puntos(session, facturadb.punto_id)
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "DELETE",
             "tabla": "Factura",
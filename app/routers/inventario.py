@@ -1,46 +1,49 @@
-from uuid import uuid3, uuid4
-from fastapi import APIRouter, status, HTTPException, Depends
-from typing import List, Annotated
-from sqlalchemy.orm import Session
+from uuid import uuid4
+from fastapi import APIRouter, status, HTTPException, Depends, Query
+from typing import List, Annotated, Literal
+from sqlalchemy.ext.asyncio import AsyncSession
 import sqlalchemy as db
-from ..database.database import Base, engine
+from ..database.database import get_db, get_db_lectura
 from ..schemas import inventario
 from ..models import models
 from datetime import date
+from ..fecha import fecha
 from ..auth import auth
+from ..cache import cache
+from ..permisos import permisos
 from ..log import log
+from ..existencia import existencia
+from ..venta_diaria import venta_diaria
+from ..exportar import exportar
+from ..respuesta import respuesta
+from ..kardex import kardex
 
-# Create the database
-Base.metadata.create_all(engine)
 
 router = APIRouter()
 
+# movimientos por pagina de la tarjeta de inventario
+LIMITE_MAXIMO = 1000
+
+
+def ventas_del_inventario(inventario_id: int):
+
+    # condicion de las ventas hechas de las distribuciones del inventario
+    return models.Venta.distribucion_id.in_(db.select(models.Distribucion.id)\
+        .where(models.Distribucion.inventario_id == inventario_id))
+
 
 @router.post("/inventario", response_model=inventario.Inventario, status_code=status.HTTP_201_CREATED, tags=["inventario"])
-async def create_inventario(inventario: inventario.InventarioCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def create_inventario(inventario: inventario.InventarioCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    # verificar si usuario autenticado es propietario del negocio
-    prop_negocio = session.query(models.Negocio)\
-        .where(models.Negocio.id == inventario.negocio_id,
-               models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-        .count()
-
-    # verificar si usuario autenticado es propietario del producto
-    prop_producto = session.query(models.Producto)\
-        .join(models.Negocio)\
-        .where(models.Negocio.id == inventario.negocio_id,
-               models.Producto.id == inventario.producto_id,  models.Negocio.fecha_licencia >= date.today())\
-        .count()
+    # verificar si usuario autenticado es propietario del negocio y el producto es del negocio
+    productodb = await session.get(models.Producto, inventario.producto_id)
 
-    if not prop_producto or not prop_negocio:
+    if not alcance.negocio(inventario.negocio_id) or not productodb or productodb.negocio_id != inventario.negocio_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
@@ -51,51 +54,43 @@ async def create_inventario(inventario: inventario.InventarioCreate, token: Anno
 
     # add it to the session and commit it
     session.add(inventariodb)
-    session.commit()
-    session.refresh(inventariodb)
+    await session.flush()
+    await existencia.crear_almacen(session, inventariodb.id, inventariodb.cantidad)
+    await session.commit()
+    await cache.invalidar(inventario.negocio_id)
+    await session.refresh(inventariodb)
 
-    log.create_log({
+    await log.create_log({
         "usuario": current_user.usuario,
         "accion": "CREATE",
         "tabla": "Inventario",
         "descripcion": f"Ha creado el id {inventariodb.id}"
     })
 
-    # close the session
-    session.close()
-
     # return the inventario object
     return inventariodb
 
 
 @router.get("/inventario/{id}", response_model=inventario.Inventario, tags=["inventario"])
-async def read_inventario(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_inventario(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the inventario item with the given id
-    inventariodb: inventario.Inventario = session.query(
-        models.Inventario).get(id)
+    inventariodb: inventario.Inventario = await session.get(models.Inventario, id)
 
     # verificar si usuario autenticado es propietario del negocio
     if inventariodb:
-        prop_negocio = session.query(models.Negocio)\
-            .where(models.Negocio.id == inventariodb.negocio_id, models.Negocio.propietario_id == current_user.id)\
-            .count()
+        prop_negocio = await session.scalar(db.select(db.func.count()).select_from(models.Negocio)\
+            .where(models.Negocio.id == inventariodb.negocio_id, models.Negocio.propietario_id == current_user.id))
 
         if not prop_negocio:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
-    # close the session
-    session.close()
-
     if not inventariodb:
         raise HTTPException(
             status_code=404, detail=f"Inventario con id {id} no encontrado")
@@ -104,33 +99,34 @@ async def read_inventario(id: int, token: Annotated[str, Depends(auth.oauth2_sch
 
 
 @router.put("/inventario/{id}", tags=["inventario"])
-async def update_inventario(id: int, inventario: inventario.Inventario, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_inventario(id: int, inventario: inventario.Inventario, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the producto item with the given id
-    inventariodb: inventario.Inventario = session.query(
-        models.Inventario).get(id)
+    inventariodb: inventario.Inventario = await session.get(models.Inventario, id)
 
     # verificar si usuario autenticado es propietario del negocio
     if inventariodb:
-        prop_negocio = session.query(models.Negocio)\
-            .where(models.Negocio.id == inventario.negocio_id,
-                   models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        if not prop_negocio:
+        if not alcance.negocio(inventariodb.negocio_id) or not alcance.negocio(inventario.negocio_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
     # update inventario item with the given task (if an item with the given id was found)
     if inventariodb:
+        await existencia.ajustar_almacen(session, {inventariodb.id: inventario.cantidad - inventariodb.cantidad})
+
+        # las ventas ya hechas del inventario se acumulan con su producto, negocio, costo y precio
+        ventas_inventario = ventas_del_inventario(inventariodb.id)
+        reacumular = (inventario.producto_id, inventario.negocio_id, inventario.costo, inventario.precio_venta) != \
+            (inventariodb.producto_id, inventariodb.negocio_id, inventariodb.costo, inventariodb.precio_venta)
+        if reacumular:
+            await venta_diaria.restar(session, ventas_inventario)
+
+        negocio_anterior = inventariodb.negocio_id
         inventariodb.producto_id = inventario.producto_id
         inventariodb.cantidad = inventario.cantidad
         inventariodb.um = inventario.um
@@ -139,51 +135,45 @@ async def update_inventario(id: int, inventario: inventario.Inventario, token: A
         inventariodb.monto = inventario.costo * inventario.cantidad
         inventariodb.fecha = inventario.fecha
         inventariodb.negocio_id = inventario.negocio_id
-        session.commit()
+        if reacumular:
+            await venta_diaria.sumar(session, ventas_inventario)
+        await session.commit()
+        await cache.invalidar(negocio_anterior, inventario.negocio_id)
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "UPDATE",
             "tabla": "Inventario",
             "descripcion": f"Ha editado el id {inventariodb.id}"
         })
 
-    # close the session
-    session.close()
-
 
 @router.delete("/inventario/{id}", status_code=status.HTTP_204_NO_CONTENT, tags=["inventario"])
-async def delete_inventario(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def delete_inventario(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the inventario item with the given id
-    inventariodb: inventario.Inventario = session.query(
-        models.Inventario).get(id)
+    inventariodb: inventario.Inventario = await session.get(models.Inventario, id)
 
     # verificar si usuario autenticado es propietario del negocio
     if inventariodb:
-        prop_negocio = session.query(models.Negocio)\
-            .where(models.Negocio.id == inventariodb.negocio_id, models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        if not prop_negocio:
+        if not alcance.negocio(inventariodb.negocio_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
     # if inventario item with given id exists, delete it from the database. Otherwise raise 404 error
     if inventariodb:
-        session.delete(inventariodb)
-        session.commit()
-        session.close()
+        # las ventas se eliminan en cascada con las distribuciones, se restan antes del acumulado diario
+        await venta_diaria.restar(session, ventas_del_inventario(inventariodb.id))
+        await session.delete(inventariodb)
+        await session.commit()
+        await cache.invalidar(inventariodb.negocio_id)
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "DELETE",
             "tabla": "Inventario",
@@ -197,61 +187,65 @@ async def delete_inventario(id: int, token: Annotated[str, Depends(auth.oauth2_s
 
 
 @router.get("/inventarios/", tags=["inventarios"], description="Productos en inventario por propietario")
-async def read_inventarios_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_inventarios_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the negocio item with the given id
-    puntosdb = session.query(models.Inventario.id, models.Producto.nombre, models.Inventario.cantidad, models.Negocio.nombre, models.Inventario.costo, models.Inventario.fecha, models.Inventario.precio_venta)\
+    puntosdb = await session.execute(db.select(models.Inventario.id, models.Producto.nombre, models.Inventario.cantidad, models.Negocio.nombre.label("negocio_id"), models.Inventario.costo, models.Inventario.fecha, models.Inventario.precio_venta)\
         .select_from(models.Inventario)\
         .join(models.Negocio)\
         .join(models.User)\
         .join(models.Producto, models.Inventario.producto_id == models.Producto.id)\
         .where(models.User.usuario.like(current_user.usuario))\
-        .order_by(models.Inventario.fecha.desc(), models.Producto.nombre)\
-        .all()
+        .order_by(models.Inventario.fecha.desc(), models.Producto.nombre))
 
-    resultdb = []
-    for row in puntosdb:
-        resultdb.append({
-            "id": row[0],
-            "nombre": row[1],
-            "cantidad": row[2],
-            "negocio_id": row[3],
-            "costo": row[4],
-            "fecha": row[5],
-            "precio_venta": row[6],
-        })
+    return respuesta.RespuestaJSON(respuesta.filas(puntosdb))
 
-    session.close()
-    return resultdb
+
+@router.get("/inventarios-exportar", tags=["inventarios"], description="Exportar inventarios de un propietario en ndjson o csv")
+async def export_inventarios_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)],
+                                         formato: Literal["ndjson", "csv"] = "ndjson"):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "propietario":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    stmt = db.select(models.Inventario.id, models.Inventario.fecha, models.Producto.nombre, models.Negocio.nombre,
+                     models.Inventario.cantidad, models.Inventario.um, models.Inventario.costo,
+                     models.Inventario.monto, models.Inventario.precio_venta)\
+        .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
+        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
+        .where(models.Negocio.propietario_id == current_user.id)\
+        .order_by(models.Inventario.fecha, models.Inventario.id)
+
+    return exportar.exportar(stmt, ["id", "fecha", "nombre_producto", "nombre_negocio", "cantidad", "um", "costo",
+                                    "monto", "precio_venta"], formato, "inventarios")
 
 
 @router.get("/inventarios-a-distribuir/", tags=["inventarios"], description="Productos en Inventario no distribuidos")
-async def cantidad_distribuida_inventario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def cantidad_distribuida_inventario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the inventario item with the given id
-    inventariosdb = session.query(models.Inventario.id,
+    distribuido = db.func.sum(db.func.coalesce((models.Distribucion.cantidad), 0))
+    inventariosdb = respuesta.filas(await session.execute(db.select(models.Inventario.id,
                                   models.Producto.nombre,
                                   models.Inventario.cantidad,
                                   models.Inventario.fecha,
                                   models.Inventario.costo,
-                                  db.func.sum(db.func.coalesce((models.Distribucion.cantidad), 0)),
-                                  models.Inventario.negocio_id, models.Negocio.nombre)\
+                                  distribuido.label("distribuido"),
+                                  models.Inventario.negocio_id,
+                                  (models.Inventario.cantidad - distribuido).label("existencia"),
+                                  models.Negocio.nombre.label("nombre_negocio"))\
         .select_from(models.Inventario)\
         .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
         .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
@@ -259,86 +253,64 @@ async def cantidad_distribuida_inventario(token: Annotated[str, Depends(auth.oau
         .outerjoin(models.Distribucion, models.Distribucion.inventario_id == models.Inventario.id)\
         .where(models.User.usuario.like(current_user.usuario))\
         .group_by(models.Inventario.producto_id, models.Inventario.costo, models.Inventario.id, models.Producto.nombre, models.Negocio.nombre)\
-        .order_by(models.Producto.nombre)\
-        .all()
-
-    resultdb = []
-    for row in inventariosdb:
-        if row[2] - row[5]:
-            resultdb.append({
-                "id": row[0],
-                "nombre": row[1],
-                "cantidad": row[2],
-                "fecha": row[3],
-                "costo": row[4],
-                "distribuido": row[5],
-                "negocio_id": row[6],
-                "existencia": row[2] - row[5],
-                "nombre_negocio": row[7],
-            })
-
-    session.close()
+        .order_by(models.Producto.nombre)))
 
     if not inventariosdb:
         raise HTTPException(
             status_code=404, detail=f"Inventarios no encontrados")
 
-    return resultdb
+    return respuesta.RespuestaJSON([row for row in inventariosdb if row["existencia"]])
 
 
 @router.get("/inventarios-almacen/", tags=["inventarios"], description="Productos en Inventario no distribuidos")
-async def cantidad_distribuida_inventario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def cantidad_distribuida_inventario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+    # respuesta guardada mientras no cambien los negocios del propietario
+    clave, resultdb = await cache.leer(session, "inventarios-almacen", current_user.id)
+    if resultdb is not None:
+        return respuesta.RespuestaJSON(resultdb)
 
-    # get the inventario item with the given id
-    inventariosdb = session.query(models.Producto.nombre,
-                                  db.func.sum(db.func.coalesce((models.Inventario.cantidad), 0)),
+    # existencia en almacen por producto, costo y negocio
+    # cada inventario entra una sola vez, con lo distribuido ya sumado por inventario
+    condiciones = [models.Negocio.propietario_id == current_user.id]
+    distribuciones = existencia.distribuido(condiciones)
+
+    cantidad = db.func.sum(db.func.coalesce((models.Inventario.cantidad), 0))
+    distribuido = db.func.sum(db.func.coalesce(distribuciones.c.cantidad, 0))
+    inventariosdb = respuesta.filas(await session.execute(db.select(models.Producto.nombre,
+                                  cantidad.label("cantidad"),
                                   models.Inventario.costo,
-                                  db.func.sum(db.func.coalesce((models.Distribucion.cantidad), 0)),
+                                  distribuido.label("distribuido"),
                                   models.Inventario.negocio_id,
-                                  models.Negocio.nombre)\
+                                  (cantidad - distribuido).label("existencia"),
+                                  models.Negocio.nombre.label("nombre_negocio"))\
         .select_from(models.Inventario)\
         .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
         .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
-        .outerjoin(models.Distribucion, models.Distribucion.inventario_id == models.Inventario.id)\
-        .where(models.Negocio.propietario_id == current_user.id)\
+        .outerjoin(distribuciones, distribuciones.c.inventario_id == models.Inventario.id)\
+        .where(*condiciones)\
         .group_by(models.Inventario.producto_id, models.Inventario.costo, models.Producto.nombre,
                   models.Negocio.nombre, models.Inventario.negocio_id)\
-        .order_by(models.Producto.nombre)\
-        .all()
+        .order_by(models.Producto.nombre)))
 
-    resultdb = []
-    for row in inventariosdb:
-        if row[1] - row[3]:
-            resultdb.append({
-                "id": uuid4(),
-                "nombre": row[0],
-                "cantidad": row[1],
-                "costo": row[2],
-                "distribuido": row[3],
-                "negocio_id": row[4],
-                "existencia": row[1] - row[3],
-                "nombre_negocio": row[5],
-            })
-
-    session.close()
+    resultdb = [{"id": uuid4(), **row} for row in inventariosdb if row["existencia"]]
 
     if not inventariosdb:
         raise HTTPException(
             status_code=404, detail=f"Inventarios no encontrados")
 
-    return resultdb
+    await cache.guardar(clave, resultdb)
+
+    return respuesta.RespuestaJSON(resultdb)
 
 
 @router.get("/inventarios-costos-brutos/{fecha_inicio}/{fecha_fin}/{negocio}", tags=["inventarios"], description="Monto propietario")
-async def read_inventarios_propietario(fecha_inicio: date, fecha_fin: date, negocio: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_inventarios_propietario(fecha_inicio: date, fecha_fin: date, negocio: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db_lectura)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
@@ -350,21 +322,18 @@ async def read_inventarios_propietario(fecha_inicio: date, fecha_fin: date, nego
         raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
                             detail=f"La fecha fin debe ser mayor que la fecha inicio")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the negocio item with the given id
-    puntosdb = session.query(db.func.sum(models.Inventario.monto),
+    puntosdb = (await session.execute(db.select(db.func.sum(models.Inventario.monto),
                             db.extract("year", models.Inventario.fecha), db.extract("month", models.Inventario.fecha),
                             db.extract("day", models.Inventario.fecha))\
         .join(models.Negocio)\
         .join(models.User)\
         .join(models.Producto, models.Inventario.producto_id == models.Producto.id)\
         .where(models.User.usuario.like(current_user.usuario),
-                db.func.date(models.Inventario.fecha) >= fecha_inicio, db.func.date(models.Inventario.fecha) <= fecha_fin,
+                fecha.rango(models.Inventario.fecha, fecha_inicio, fecha_fin),
                 models.Negocio.id == negocio)\
         .group_by(db.extract("year", models.Inventario.fecha), db.extract("month", models.Inventario.fecha), db.extract("day", models.Inventario.fecha))\
-        .order_by(db.extract("year", models.Inventario.fecha), db.extract("month", models.Inventario.fecha), db.extract("day", models.Inventario.fecha).desc())\
+        .order_by(db.extract("year", models.Inventario.fecha), db.extract("month", models.Inventario.fecha), db.extract("day", models.Inventario.fecha).desc())))\
         .all()
 
     resultdb = []
@@ -375,98 +344,63 @@ async def read_inventarios_propietario(fecha_inicio: date, fecha_fin: date, nego
             "id": f"id{row[1]}-{row[2]}-{row[3]}",
         })
 
-    session.close()
     return resultdb
 
 
 @router.get("/inventarios-contador/{fecha_inicio}/{fecha_fin}", tags=["admin"], description="Contador de inventarios")
-async def read_count_inventarios(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_count_inventarios(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the inventarios item with the given id
-    contadorInventarios = session.query(models.Inventario).count()
+    contadorInventarios = await session.scalar(db.select(db.func.count()).select_from(models.Inventario))
 
-    contadorInventariosFecha = session.query(models.Inventario)\
-                                .where(models.Inventario.fecha_creado >= fecha_inicio, models.Inventario.fecha_creado <= fecha_fin)\
-                                .count()
+    contadorInventariosFecha = await session.scalar(db.select(db.func.count()).select_from(models.Inventario)\
+                                .where(fecha.rango(models.Inventario.fecha_creado, fecha_inicio, fecha_fin)))
 
-    # close the session
-    session.close()
-    
     return {"cantidad_inventarios": contadorInventarios, "nuevos_inventarios":contadorInventariosFecha }
 
 
-@router.get("/inventarios-tarjeta/{fecha_inicio}/{fecha_fin}/{id}", tags=["inventarios"], description="Productos en inventario por propietario")
-async def read_inventarios_propietario(fecha_inicio: date, fecha_fin: date, id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+@router.get("/inventarios-tarjeta/{fecha_inicio}/{fecha_fin}/{id}", tags=["inventarios"], description="Tarjeta de inventario de un producto, paginada por cursor")
+async def read_inventarios_propietario(fecha_inicio: date, fecha_fin: date, id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db_lectura)],
+                                       cursor: str | None = None, limite: Annotated[int | None, Query(ge=1, le=LIMITE_MAXIMO)] = None):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+    if fecha_inicio > fecha_fin:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail=f"La fecha fin debe ser mayor que la fecha inicio")
 
-    # get the negocio item with the given id
-    inventariodb = session.query(models.Inventario.id, models.Producto.nombre,
-                             models.Inventario.cantidad, models.Negocio.nombre,
-                             models.Inventario.costo, models.Inventario.fecha, 
-                             models.Inventario.precio_venta)\
-        .select_from(models.Inventario)\
-        .join(models.Negocio)\
-        .join(models.Producto, models.Inventario.producto_id == models.Producto.id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Inventario.fecha >= fecha_inicio,
-                models.Inventario.fecha <= fecha_fin, models.Producto.id == id)\
-        .order_by(models.Inventario.fecha.desc(), models.Producto.nombre)\
-        .all()
+    # entradas, salidas y ventas en orden con sus saldos, sin limite devuelve todo el periodo
+    resultdb = respuesta.filas(await session.execute(kardex.consulta(id, current_user.id, fecha_inicio, fecha_fin, cursor,
+                                                                     limite + 1 if limite is not None else None)))
 
-    resultdb = []
-    for row in inventariodb:
-        resultdb.append({
-            "id": row[0],
-            "nombre": row[1],
-            "cantidad": row[2],
-            "negocio_id": row[3],
-            "costo": row[4],
-            "fecha": row[5],
-            "precio_venta": row[6],
-            "accion": "Entrada",
-        })
+    # si hay un movimiento de mas existe otra pagina
+    headers = {}
+    if limite is not None and len(resultdb) > limite:
+        resultdb = resultdb[:limite]
+        headers["X-Next-Cursor"] = kardex.crear_cursor(resultdb[-1])
+
+    return respuesta.RespuestaJSON(resultdb, headers=headers)
 
-    distribucionesdb = session.query(models.Inventario.id, models.Producto.nombre,
-                             models.Distribucion.cantidad, models.Negocio.nombre,
-                             models.Inventario.costo, models.Inventario.fecha, 
-                             models.Inventario.precio_venta)\
-        .select_from(models.Distribucion)\
-        .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .where(models.Negocio.propietario_id == current_user.id, models.Distribucion.fecha >= fecha_inicio,
-                models.Distribucion.fecha <= fecha_fin, models.Producto.id == id)\
-        .order_by(models.Distribucion.fecha.desc(), models.Producto.nombre)\
-        .all()
-    
-    for row in distribucionesdb:
-        resultdb.append({
-            "id": uuid4(),
-            "nombre": row[1],
-            "cantidad": row[2],
-            "negocio_id": row[3],
-            "costo": row[4],
-            "fecha": row[5],
-            "precio_venta": row[6],
-            "accion": "Salida",
-        })
 
-    resultdb.sort(key=lambda result : result['fecha'], reverse=True)
+@router.get("/inventarios-tarjeta-exportar/{fecha_inicio}/{fecha_fin}/{id}", tags=["inventarios"], description="Exportar la tarjeta de inventario de un producto en ndjson o csv")
+async def export_inventarios_tarjeta(fecha_inicio: date, fecha_fin: date, id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)],
+                                     formato: Literal["ndjson", "csv"] = "ndjson"):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "propietario":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    if fecha_inicio > fecha_fin:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail=f"La fecha fin debe ser mayor que la fecha inicio")
 
-    session.close()
-    return resultdb
\ No newline at end of file
+    return exportar.exportar(kardex.consulta(id, current_user.id, fecha_inicio, fecha_fin), kardex.COLUMNAS, formato, "tarjeta")
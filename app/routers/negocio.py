@@ -1,30 +1,28 @@
 from fastapi import APIRouter, status, HTTPException, Depends
 from typing import List, Annotated
-from sqlalchemy.orm import Session
-from ..database.database import Base, engine
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
+from ..database.database import get_db
 from ..schemas import negocio
 from ..models import models
 from ..auth import auth
+from ..permisos import permisos
 from ..log import log
 from datetime import date
+from ..fecha import fecha
 
-# Create the database
-Base.metadata.create_all(engine)
 
 router = APIRouter()
 
 
 @router.post("/negocio", response_model=negocio.Negocio, status_code=status.HTTP_201_CREATED, tags=["negocio"])
-async def create_negocio(negocio: negocio.NegocioCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def create_negocio(negocio: negocio.NegocioCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # create an instance of the negocio database model
     negociodb = models.Negocio(nombre=negocio.nombre, direccion=negocio.direccion,
                                informacion=negocio.informacion,
@@ -34,59 +32,45 @@ async def create_negocio(negocio: negocio.NegocioCreate, token: Annotated[str, D
 
     # add it to the session and commit it
     session.add(negociodb)
-    session.commit()
-    session.refresh(negociodb)
+    await session.commit()
+    permisos.invalidar()
+    await session.refresh(negociodb)
 
-    log.create_log({
+    await log.create_log({
         "usuario": current_user.usuario,
         "accion": "CREATE",
         "tabla": "Negocio",
         "descripcion": f"Ha creado el id {negociodb.id}"
     })
 
-    # close the session
-    session.close()
-
     # return the negocio object
     return negociodb
 
 
 @router.get("/negocio", response_model=List[negocio.Negocio], tags=["negocio"], description="Listado de negocios")
-async def read_negocio_list(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_negocio_list(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the negocio item with the given id
-    negociodb = session.query(models.Negocio).order_by(models.Negocio.nombre).all()
-
-    # close the session
-    session.close()
+    negociodb = (await session.scalars(db.select(models.Negocio).order_by(models.Negocio.nombre))).all()
 
     return negociodb
 
 
 @router.get("/negocio/{id}", response_model=negocio.Negocio, tags=["negocio"])
-async def read_negocio(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_negocio(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the negocio item with the given id
-    negociodb = session.query(models.Negocio).get(id)
-
-    # close the session
-    session.close()
+    negociodb = await session.get(models.Negocio, id)
 
     if not negociodb:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -96,18 +80,15 @@ async def read_negocio(id: int, token: Annotated[str, Depends(auth.oauth2_scheme
 
 
 @router.put("/negocio/{id}", tags=["negocio"])
-async def update_negocio(id: int, negocio: negocio.NegocioCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_negocio(id: int, negocio: negocio.NegocioCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the provincia item with the given id
-    negociodb: negocio.Negocio = session.query(models.Negocio).get(id)
+    negociodb: negocio.Negocio = await session.get(models.Negocio, id)
 
     # update negocio item with the given task (if an item with the given id was found)
     if negociodb:
@@ -118,40 +99,35 @@ async def update_negocio(id: int, negocio: negocio.NegocioCreate, token: Annotat
         negociodb.activo = negocio.activo
         negociodb.propietario_id = negocio.propietario_id
 
-        session.commit()
+        await session.commit()
+        permisos.invalidar()
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "UPDATE",
             "tabla": "Negocio",
             "descripcion": f"Ha editado el id {negociodb.id}"
         })
 
-    # close the session
-    session.close()
-
 
 @router.delete("/negocio/{id}", status_code=status.HTTP_204_NO_CONTENT, tags=["negocio"])
-async def delete_negocio(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def delete_negocio(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the negocio item with the given id
-    negociodb = session.query(models.Negocio).get(id)
+    negociodb = await session.get(models.Negocio, id)
 
     # if negocio item with given id exists, delete it from the database. Otherwise raise 404 error
     if negociodb:
-        session.delete(negociodb)
-        session.commit()
-        session.close()
+        await session.delete(negociodb)
+        await session.commit()
+        permisos.invalidar()
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "DELETE",
             "tabla": "Negocio",
@@ -165,44 +141,31 @@ async def delete_negocio(id: int, token: Annotated[str, Depends(auth.oauth2_sche
 
 
 @router.get("/negocios/", response_model=List[negocio.Negocio], tags=["negocios"], description="Listado de negocios")
-async def read_negocios_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_negocios_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    negociosdb = session.query(models.Negocio).join(
-        models.User).where(models.User.usuario.like(current_user.usuario)).order_by(models.Negocio.nombre).all()
-
-    # close the session
-    session.close()
+    negociosdb = (await session.scalars(db.select(models.Negocio).join(
+        models.User).where(models.User.usuario.like(current_user.usuario)).order_by(models.Negocio.nombre))).all()
 
     return negociosdb
 
 
 @router.get("/negocios-contador/{fecha_inicio}/{fecha_fin}", tags=["admin"], description="Contador de negocios")
-async def read_count_negocios(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_count_negocios(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the negocio item with the given id
-    contadorNegocios = session.query(models.Negocio).count()
+    contadorNegocios = await session.scalar(db.select(db.func.count()).select_from(models.Negocio))
 
-    contadorNegociosFecha = session.query(models.Negocio)\
-                                .where(models.Negocio.fecha_creado >= fecha_inicio, models.Negocio.fecha_creado <= fecha_fin)\
-                                .count()
+    contadorNegociosFecha = await session.scalar(db.select(db.func.count()).select_from(models.Negocio)\
+                                .where(fecha.rango(models.Negocio.fecha_creado, fecha_inicio, fecha_fin)))
 
-    # close the session
-    session.close()
-    
     return {"cantidad_negocios": contadorNegocios, "nuevos_negocios":contadorNegociosFecha }
\ No newline at end of file
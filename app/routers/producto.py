@@ -1,42 +1,37 @@
 from fastapi import APIRouter, status, HTTPException, Depends
 from typing import List, Annotated
-from sqlalchemy.orm import Session
-from ..database.database import Base, engine
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
+from ..database.database import get_db
 from ..schemas import producto
 from ..models import models
 from ..auth import auth
+from ..cache import cache
+from ..permisos import permisos
 from ..log import log
+from ..respuesta import respuesta
 from datetime import date
+from ..fecha import fecha
 
-# Create the database
-Base.metadata.create_all(engine)
 
 router = APIRouter()
 
 
 @router.post("/producto", response_model=producto.Producto, status_code=status.HTTP_201_CREATED, tags=["producto"])
-async def create_producto(producto: producto.ProductoCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def create_producto(producto: producto.ProductoCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # verificar si usuario autenticado es propietario del negocio
-    prop_negocio = session.query(models.Negocio)\
-        .where(models.Negocio.id == producto.negocio_id, models.Negocio.propietario_id == current_user.id,
-                models.Negocio.fecha_licencia >= date.today())\
-        .count()
-
-    if not prop_negocio:
+    if not alcance.negocio(producto.negocio_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    existe_producto = session.query(models.Producto).where(
-        models.Producto.nombre == producto.nombre, models.Producto.negocio_id == producto.negocio_id).count()
+    existe_producto = await session.scalar(db.select(db.func.count()).select_from(models.Producto).where(
+        models.Producto.nombre == producto.nombre, models.Producto.negocio_id == producto.negocio_id))
 
     if existe_producto:
         raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
@@ -48,50 +43,40 @@ async def create_producto(producto: producto.ProductoCreate, token: Annotated[st
 
     # add it to the session and commit it
     session.add(productodb)
-    session.commit()
-    session.refresh(productodb)
+    await session.commit()
+    await session.refresh(productodb)
 
-    log.create_log({
+    await log.create_log({
         "usuario": current_user.usuario,
         "accion": "CREATE",
         "tabla": "Producto",
         "descripcion": f"Ha creado el id {productodb.id}"
     })
 
-    # close the session
-    session.close()
-
     # return the producto object
     return productodb
 
 
 @router.get("/producto/{id}", tags=["producto"])
-async def read_producto(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_producto(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the producto item with the given id
-    productodb = session.query(models.Producto).get(id)
+    productodb = await session.get(models.Producto, id)
 
     # verificar si usuario autenticado es propietario del negocio
     if productodb:
-        prop_negocio = session.query(models.Negocio)\
-            .where(models.Negocio.id == productodb.negocio_id, models.Negocio.propietario_id == current_user.id)\
-            .count()
+        prop_negocio = await session.scalar(db.select(db.func.count()).select_from(models.Negocio)\
+            .where(models.Negocio.id == productodb.negocio_id, models.Negocio.propietario_id == current_user.id))
 
         if not prop_negocio:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
-    # close the session
-    session.close()
-
     if not productodb:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"El producto con id {id} no encontrado")
@@ -100,79 +85,62 @@ async def read_producto(id: int, token: Annotated[str, Depends(auth.oauth2_schem
 
 
 @router.put("/producto/{id}", tags=["producto"])
-async def update_producto(id: int, producto: producto.Producto, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_producto(id: int, producto: producto.Producto, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the producto item with the given id
-    productodb: producto.Producto = session.query(
-        models.Producto).get(id)
+    productodb: producto.Producto = await session.get(models.Producto, id)
 
     # verificar si usuario autenticado es propietario del negocio
     if productodb:
-        prop_negocio = session.query(models.Negocio)\
-            .where(models.Negocio.id == producto.negocio_id,
-                   models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        if not prop_negocio:
+        if not alcance.negocio(productodb.negocio_id) or not alcance.negocio(producto.negocio_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
     # update producto item with the given task (if an item with the given id was found)
     if productodb:
+        negocio_anterior = productodb.negocio_id
         productodb.nombre = producto.nombre
         productodb.negocio_id = producto.negocio_id
-        session.commit()
+        await session.commit()
+        await cache.invalidar(negocio_anterior, producto.negocio_id)
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "UPDATE",
             "tabla": "Producto",
             "descripcion": f"Ha editado el id {productodb.id}"
         })
 
-    # close the session
-    session.close()
-
 
 @router.delete("/producto/{id}", status_code=status.HTTP_204_NO_CONTENT, tags=["producto"])
-async def delete_producto(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def delete_producto(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the producto item with the given id
-    productodb = session.query(models.Producto).get(id)
+    productodb = await session.get(models.Producto, id)
 
     # verificar si usuario autenticado es propietario del negocio
     if productodb:
-        prop_negocio = session.query(models.Negocio)\
-            .where(models.Negocio.id == productodb.negocio_id, models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        if not prop_negocio:
+        if not alcance.negocio(productodb.negocio_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
 
     # if producto item with given id exists, delete it from the database. Otherwise raise 404 error
     if productodb:
-        session.delete(productodb)
-        session.commit()
-        session.close()
+        await session.delete(productodb)
+        await session.commit()
+        await cache.invalidar(productodb.negocio_id)
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "DELETE",
             "tabla": "Producto",
@@ -186,58 +154,34 @@ async def delete_producto(id: int, token: Annotated[str, Depends(auth.oauth2_sch
 
 
 @router.get("/productos/", tags=["productos"])
-async def read_productos_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_productos_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    negociosdb = session.query(models.Producto.id, models.Producto.nombre,
-                               models.Negocio.id, models.Negocio.nombre)\
+    negociosdb = await session.execute(db.select(models.Producto.id, models.Producto.nombre,
+                               models.Negocio.id.label("negocio_id"), models.Negocio.nombre.label("negocio_nombre"))\
         .join(models.Negocio)\
         .join(models.User)\
-        .where(models.User.usuario.like(current_user.usuario))\
-        .all()
+        .where(models.User.usuario.like(current_user.usuario)))
 
-    resultdb = []
-
-    for row in negociosdb:
-        resultdb.append({
-            "id": row[0],
-            "nombre": row[1],
-            "negocio_id": row[2],
-            "negocio_nombre": row[3]
-        })
-
-    # close the session
-    session.close()
-
-    return resultdb
+    return respuesta.RespuestaJSON(respuesta.filas(negociosdb))
 
 
 @router.get("/productos-contador/{fecha_inicio}/{fecha_fin}", tags=["admin"], description="Contador de productos")
-async def read_count_productos(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_count_productos(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the productos item with the given id
-    contadorProductos = session.query(models.Producto).count()
+    contadorProductos = await session.scalar(db.select(db.func.count()).select_from(models.Producto))
 
-    contadorProductosFecha = session.query(models.Producto)\
-                                .where(models.Producto.fecha_creado >= fecha_inicio, models.Producto.fecha_creado <= fecha_fin)\
-                                .count()
+    contadorProductosFecha = await session.scalar(db.select(db.func.count()).select_from(models.Producto)\
+                                .where(fecha.rango(models.Producto.fecha_creado, fecha_inicio, fecha_fin)))
 
-    # close the session
-    session.close()
-    
     return {"cantidad_productos": contadorProductos, "nuevos_productos":contadorProductosFecha }
\ No newline at end of file
@@ -1,33 +1,30 @@
 from fastapi import APIRouter, status, HTTPException, Depends
 from typing import List, Annotated
-from sqlalchemy.orm import Session
-from ..database.database import Base, engine
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
+from ..database.database import get_db
 from ..schemas import user
 from ..models import models
 from datetime import date
+from ..fecha import fecha
 from ..auth import auth
 from ..log import log
 
-# Create the database
-Base.metadata.create_all(engine)
 
 router = APIRouter()
 
 
 @router.post("/user", response_model=user.User, status_code=status.HTTP_201_CREATED, tags=["user"])
-async def create_user(user: user.UserInDB, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def create_user(user: user.UserInDB, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # comprobar si existe usuario
-    usuario_buscado = session.query(models.User).where(
-        models.User.usuario == user.usuario).count()
+    usuario_buscado = await session.scalar(db.select(db.func.count()).select_from(models.User).where(
+        models.User.usuario == user.usuario))
 
     if usuario_buscado:
         raise HTTPException(
@@ -35,43 +32,34 @@ async def create_user(user: user.UserInDB, token: Annotated[str, Depends(auth.oa
 
     # create an instance of the user database model
     userdb = models.User(usuario=user.usuario, nombre=user.nombre, email=user.email,
-                         rol=user.rol, activo=user.activo, password=auth.pwd_context.hash(user.password))
+                         rol=user.rol, activo=user.activo, password=await auth.hash_password(user.password))
 
     # add it to the session and commit it
     session.add(userdb)
-    session.commit()
-    session.refresh(userdb)
+    await session.commit()
+    await session.refresh(userdb)
 
-    log.create_log({
+    await log.create_log({
         "usuario": current_user.usuario,
         "accion": "CREATE",
         "tabla": "User",
         "descripcion": f"Ha creado el id {userdb.id}"
     })
 
-    # close the session
-    session.close()
-
     # return the user object
     return userdb
 
 
 @router.get("/user/{id}", response_model=user.User, tags=["user"])
-async def read_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the user item with the given id
-    userdb = session.query(models.User).get(id)
-
-    # close the session
-    session.close()
+    userdb = await session.get(models.User, id)
 
     if not userdb:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -81,18 +69,15 @@ async def read_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)],
 
 
 @router.put("/user/{id}", tags=["user"])
-async def update_user(id: int, user: user.UserEdit, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_user(id: int, user: user.UserEdit, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the user item with the given id
-    userdb: schemas.user.UserInDB = session.query(models.User).get(id)
+    userdb: schemas.user.UserInDB = await session.get(models.User, id)
 
     # update user item with the given task (if an item with the given id was found)
     if userdb:
@@ -100,40 +85,35 @@ async def update_user(id: int, user: user.UserEdit, token: Annotated[str, Depend
         userdb.email = user.email
         userdb.rol = user.rol
         userdb.activo = user.activo
-        session.commit()
+        await session.commit()
+        auth.invalidate_user(userdb.usuario)
 
-        log.create_log({
+        await log.create_log({
         "usuario": current_user.usuario,
         "accion": "UPDATE",
         "tabla": "User",
         "descripcion": f"Ha editado el id {userdb.id}"
     })
 
-    # close the session
-    session.close()
-
 
 @router.delete("/user/{id}", status_code=status.HTTP_204_NO_CONTENT, tags=["user"])
-async def delete_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def delete_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the user item with the given id
-    userdb = session.query(models.User).get(id)
+    userdb = await session.get(models.User, id)
 
     # if user item with given id exists, delete it from the database. Otherwise raise 404 error
     if userdb:
-        session.delete(userdb)
-        session.commit()
-        session.close()
+        await session.delete(userdb)
+        await session.commit()
+        auth.invalidate_user(userdb.usuario)
 
-        log.create_log({
+        await log.create_log({
         "usuario": current_user.usuario,
         "accion": "DELETE",
         "tabla": "User",
@@ -147,83 +127,66 @@ async def delete_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)
 
 
 @router.get("/users", response_model=List[user.UserList], tags=["users"], description="Listado de usuarios")
-async def read_users_list(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_users_list(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the users item with the given id
-    usersdb = session.query(models.User).order_by(models.User.usuario).all()
-
-    # close the session
-    session.close()
+    usersdb = (await session.scalars(db.select(models.User).order_by(models.User.usuario))).all()
 
     return usersdb
 
 
 @router.get("/users-propietarios", response_model=List[user.UserList], tags=["users"], description="Listado de usuarios con rol propietario")
-async def read_users_listpropietarios(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_users_listpropietarios(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # listado de propietarios
-    usersdb = session.query(models.User).where(
-        models.User.rol == "propietario", models.User.activo == "1")
-
-    # close the session
-    session.close()
+    usersdb = (await session.scalars(db.select(models.User).where(
+        models.User.rol == "propietario", models.User.activo == True))).all()
 
     return usersdb
 
 
 @router.put("/users-cambiar-contrasenna",status_code=status.HTTP_200_OK, tags=["users"])
-async def update_user(user: user.UserCambiaPassword, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_user(user: user.UserCambiaPassword, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #verificar si las contraseñas nuevas coinciden
     if user.contrasenna_nueva != user.repite_contrasenna_nueva:
         raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
                             detail=f"Las contraseñas no coinciden")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the user item with the given id
-    userdb: schemas.user.UserInDB = session.query(models.User)\
-        .where(models.User.usuario == current_user.usuario, models.User.activo == True).first()
+    userdb: schemas.user.UserInDB = await session.scalar(db.select(models.User)\
+        .where(models.User.usuario == current_user.usuario, models.User.activo == True))
 
-    if not userdb or  not auth.pwd_context.verify(user.contrasenna_actual, userdb.password):
+    if not userdb or  not await auth.verify_password(user.contrasenna_actual, userdb.password):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"Verifique su contraseña actual y vuelva a intentar")
 
     # update user item with the given task (if an item with the given id was found)
     if userdb:
-        userdb.password = auth.pwd_context.hash(user.contrasenna_nueva)
-        session.commit()
+        userdb.password = await auth.hash_password(user.contrasenna_nueva)
+        await session.commit()
+        auth.invalidate_user(userdb.usuario)
 
-        log.create_log({
+        await log.create_log({
         "usuario": current_user.usuario,
         "accion": "UPDATE",
         "tabla": "User",
         "descripcion": f"Ha editado el password de id {current_user}"
     })
 
-    # close the session
-    session.close()
-
 
 @router.put("/users-cambiar-contrasenna-admin/{id}",status_code=status.HTTP_200_OK, tags=["users"])
-async def update_user(id: int, user: user.UserCambiaPasswordAdmin, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_user(id: int, user: user.UserCambiaPasswordAdmin, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
   
    # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
@@ -235,107 +198,85 @@ async def update_user(id: int, user: user.UserCambiaPasswordAdmin, token: Annota
         raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
                             detail=f"Las contraseñas no coinciden")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the producto item with the given id
-    userdb: schemas.user.UserInDB = session.query(models.User).get(id)
+    userdb: schemas.user.UserInDB = await session.get(models.User, id)
 
     # update user item with the given task (if an item with the given id was found)
     if userdb:
-        userdb.password = auth.pwd_context.hash(user.contrasenna_nueva)
-        session.commit()
+        userdb.password = await auth.hash_password(user.contrasenna_nueva)
+        await session.commit()
+        auth.invalidate_user(userdb.usuario)
 
-        log.create_log({
+        await log.create_log({
         "usuario": current_user.usuario,
         "accion": "UPDATE",
         "tabla": "User",
         "descripcion": f"Ha editado el password de id {current_user}"
     })
 
-    # close the session
-    session.close()
-
 
 @router.put("/users-desbloquear/{id}", tags=["users"], description="Desbloquear usuario por id")
-async def update_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the producto item with the given id
-    userdb: schemas.user.UserInDB = session.query(models.User).get(id)
+    userdb: schemas.user.UserInDB = await session.get(models.User, id)
 
     # update user item with the given task (if an item with the given id was found)
     if userdb:
         userdb.activo = True
-        session.commit()
+        await session.commit()
+        auth.invalidate_user(userdb.usuario)
 
-        log.create_log({
+        await log.create_log({
         "usuario": current_user.usuario,
         "accion": "UPDATE",
         "tabla": "User",
         "descripcion": f"Ha editado el id {userdb.id}"
     })
 
-    # close the session
-    session.close()
-
 
 @router.put("/users-bloquear/{id}", tags=["users"], description="Bloquear usuario por id")
-async def update_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_user(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the producto item with the given id
-    userdb: schemas.user.UserInDB = session.query(models.User).get(id)
+    userdb: schemas.user.UserInDB = await session.get(models.User, id)
 
     # update user item with the given task (if an item with the given id was found)
     if userdb:
         userdb.activo = False
-        session.commit()
+        await session.commit()
+        auth.invalidate_user(userdb.usuario)
 
-        log.create_log({
+        await log.create_log({
         "usuario": current_user.usuario,
         "accion": "UPDATE",
         "tabla": "User",
         "descripcion": f"Ha editado el id {userdb.id}"
     })
 
-    # close the session
-    session.close()
-
 
 @router.get("/users-contador/{fecha_inicio}/{fecha_fin}", tags=["admin"], description="Contador de usuarios")
-async def read_count_users(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_count_users(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the users item with the given id
-    contadorUsuarios = session.query(models.User).count()
+    contadorUsuarios = await session.scalar(db.select(db.func.count()).select_from(models.User))
 
-    contadorNuevosUsuariosFecha = session.query(models.User)\
-                                .where(models.User.fecha_creado >= fecha_inicio, models.User.fecha_creado <= fecha_fin)\
-                                .count()
+    contadorNuevosUsuariosFecha = await session.scalar(db.select(db.func.count()).select_from(models.User)\
+                                .where(fecha.rango(models.User.fecha_creado, fecha_inicio, fecha_fin)))
 
-    # close the session
-    session.close()
-    
     return {"cantidad_usuarios": contadorUsuarios, "nuevos_usuarios":contadorNuevosUsuariosFecha }
@@ -1,69 +1,156 @@
-from fastapi import APIRouter, status, HTTPException, Depends
-from typing import List, Annotated
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, status, HTTPException, Depends, Query
+from typing import List, Annotated, Literal
+from sqlalchemy.ext.asyncio import AsyncSession
 import sqlalchemy as db
-from ..database.database import Base, engine
+from ..database.database import get_db, get_db_lectura
 from ..schemas import venta
 from ..models import models
-from datetime import date, datetime, timedelta
+from datetime import date, datetime
 from ..auth import auth
+from ..cache import cache
+from ..permisos import permisos
 from ..log import log
-from pytz import UTC
-from ..routers import distribucion as distribucionRouter
+from ..fecha import fecha
+from ..existencia import existencia
+from ..venta_diaria import venta_diaria
+from ..idempotencia import idempotencia
+from ..exportar import exportar
+from ..respuesta import respuesta
+from ..utilidad import utilidad
 
-# Create the database
-Base.metadata.create_all(engine)
 
 router = APIRouter()
 
+# tamaño de pagina de los listados de ventas
+LIMITE_PAGINA = 50
+LIMITE_MAXIMO = 500
+
+# ventas por lote de los puntos de venta que sincronizan sin conexion
+LOTE_MAXIMO = 1000
+
+
+def filtro_ventas(fecha_inicio: date | None = None, fecha_fin: date | None = None, punto_id: int | None = None,
+                  producto_id: int | None = None, pago_electronico: bool | None = None, pago_diferido: bool | None = None):
+
+    # filtros opcionales de los listados de ventas
+    return {"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin, "punto_id": punto_id,
+            "producto_id": producto_id, "pago_electronico": pago_electronico, "pago_diferido": pago_diferido}
+
+
+def condiciones_ventas(filtro: dict):
+
+    condiciones = [fecha.rango(models.Venta.fecha, filtro["fecha_inicio"], filtro["fecha_fin"])]
+
+    if filtro["punto_id"] is not None:
+        condiciones.append(models.Venta.punto_id == filtro["punto_id"])
+    if filtro["producto_id"] is not None:
+        condiciones.append(models.Inventario.producto_id == filtro["producto_id"])
+    if filtro["pago_electronico"] is not None:
+        condiciones.append(models.Venta.pago_electronico == filtro["pago_electronico"])
+    if filtro["pago_diferido"] is not None:
+        condiciones.append(models.Venta.pago_diferido == filtro["pago_diferido"])
+
+    return condiciones
+
+
+def crear_cursor(fecha_venta: datetime, id: int):
+    return f"{fecha_venta.isoformat()}_{id}"
+
+
+def leer_cursor(cursor: str):
+
+    # el cursor es la (fecha, id) de la ultima venta de la pagina anterior
+    try:
+        fecha_venta, id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(fecha_venta), int(id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Cursor no válido")
+
+
+async def pagina_ventas(session: AsyncSession, condiciones: list, cursor: str | None, limite: int | None):
+
+    # pagina ordenada por (fecha, id) descendente, continua despues del cursor
+    # sin cursor ni limite se devuelven todas las ventas, como antes de paginar
+    if cursor:
+        condiciones = condiciones + [db.tuple_(models.Venta.fecha, models.Venta.id) < db.tuple_(*leer_cursor(cursor))]
+        limite = limite or LIMITE_PAGINA
+
+    stmt = db.select(models.Venta.id, models.Producto.nombre.label("nombre_producto"),
+                     models.Punto.nombre.label("nombre_punto"), models.Venta.cantidad,
+                     models.Venta.precio, (models.Venta.cantidad * models.Venta.precio).label("monto"),
+                     models.Venta.fecha, models.User.nombre.label("dependiente"), models.Venta.pago_diferido,
+                     models.Venta.descripcion, models.Venta.pago_electronico
+                     )\
+        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
+        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
+        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
+        .join(models.User, models.User.id == models.Venta.usuario_id)\
+        .where(*condiciones)\
+        .order_by(models.Venta.fecha.desc(), models.Venta.id.desc())
+
+    if limite is not None:
+        stmt = stmt.limit(limite + 1)
+
+    ventasdb = respuesta.filas(await session.execute(stmt))
+
+    # si hay una venta de mas existe otra pagina
+    headers = {}
+    if limite is not None and len(ventasdb) > limite:
+        ventasdb = ventasdb[:limite]
+        headers["X-Next-Cursor"] = crear_cursor(ventasdb[-1]["fecha"], ventasdb[-1]["id"])
+
+    return respuesta.RespuestaJSON(ventasdb, headers=headers)
+
+
+async def totales_ventas(session: AsyncSession, condiciones: list, filtro: dict):
+
+    stmt = db.select(db.func.count(), db.func.coalesce(db.func.sum(models.Venta.cantidad), 0),
+                     db.func.coalesce(db.func.sum(models.Venta.cantidad * models.Venta.precio), 0))\
+        .select_from(models.Venta)\
+        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)
+
+    # el producto solo se conoce a traves de la distribucion
+    if filtro["producto_id"] is not None:
+        stmt = stmt.join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
+            .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)
+
+    totalesdb = (await session.execute(stmt.where(*condiciones))).first()
+
+    return {"cantidad_ventas": totalesdb[0], "cantidad": totalesdb[1], "monto": totalesdb[2]}
+
 
 @router.post("/venta", response_model=venta.Venta, status_code=status.HTTP_201_CREATED, tags=["venta"], description="Insertar venta")
-async def create_venta(venta: venta.VentaCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def create_venta(venta: venta.VentaCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], clave: Annotated[str | None, Depends(idempotencia.get_clave)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario" and current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    if current_user.rol == "propietario":
-        # verificar si usuario autenticado le pertenece la distribucion y el punto
-        distribuciondb = session.query(models.Distribucion)\
-            .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-            .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
-            .join(models.Punto, models.Punto.negocio_id == models.Negocio.id)\
-            .where(models.Negocio.propietario_id == current_user.id, models.Distribucion.id == venta.distribucion_id, 
-                   models.Punto.id == venta.punto_id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        if not distribuciondb:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail=f"No está autorizado a realizar esta acción")
+    # verificar si usuario autenticado le pertenece el punto, el alcance del dependiente solo tiene su punto
+    if not alcance.punto(venta.punto_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
 
-    if current_user.rol == "dependiente":
-        # verificar si usuario autenticado le pertenece el punto y la distribucion
-        puntodb = session.query(models.Punto)\
-            .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-            .join(models.Inventario, models.Inventario.negocio_id == models.Negocio.id)\
-            .join(models.Distribucion, models.Distribucion.inventario_id ==  models.Inventario.id)\
-            .where(models.Punto.id == current_user.punto_id, models.Punto.id == venta.punto_id,
-                   models.Distribucion.id == venta.distribucion_id,  models.Negocio.fecha_licencia >= date.today())\
-            .count()      
+    # una repeticion con la misma Idempotency-Key devuelve la venta original sin volver a crearla
+    if clave is not None:
+        anterior = await idempotencia.repetida(session, current_user.id, "/venta", clave)
+        if anterior is not None:
+            return anterior
 
-        if not puntodb:
+    # descontar de la existencia, falla si no alcanza o si la distribucion no es del negocio del punto
+    if not await existencia.vender(session, {venta.distribucion_id: venta.cantidad}, alcance.puntos[venta.punto_id]):
+        if not await alcance.distribucion(session, venta.distribucion_id, venta.punto_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"No está autorizado a realizar esta acción")
-
-    existencia = distribucionRouter.existencia_distribucion_producto(venta.distribucion_id)
-    
-    if not existencia.get("disponible") or existencia.get("disponible") < venta.cantidad:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
                             detail=f"El producto no está disponible")
    
-    time_diff = timedelta(hours=5)
-    new_time = venta.fecha - time_diff
+    new_time = fecha.naive_utc(venta.fecha) - fecha.DESFASE
 
     # create an instance of the venta database model
     ventadb = models.Venta(distribucion_id=venta.distribucion_id, cantidad=venta.cantidad,
@@ -74,36 +161,155 @@ async def create_venta(venta: venta.VentaCreate, token: Annotated[str, Depends(a
 
     # add it to the session and commit it
     session.add(ventadb)
-    session.commit()
-    session.refresh(ventadb)
+    await session.flush()
+    await venta_diaria.sumar(session, models.Venta.id == ventadb.id)
+
+    # valores guardados en la base de datos, el monto ya redondeado por la columna
+    await session.refresh(ventadb)
 
-    log.create_log({
+    # la respuesta de la clave se confirma junto con la venta, igual a la que se devuelve
+    if clave is not None:
+        guardada = await idempotencia.registrar(session, current_user.id, clave, ventadb)
+
+    await session.commit()
+    await cache.invalidar_puntos(session, venta.punto_id)
+
+    if clave is not None:
+        idempotencia.recordar(current_user.id, "/venta", clave, guardada)
+
+    await log.create_log({
         "usuario": current_user.usuario,
         "accion": "CREATE",
         "tabla": "Venta",
         "descripcion": f"Ha creado el id {ventadb.id}"
     })
 
-    # close the session
-    session.close()
-
     # return the venta object
     return ventadb
 
 
+@router.post("/ventas/batch", response_model=List[venta.VentaLoteResultado], tags=["ventas"], description="Insertar un lote de ventas con claves de idempotencia")
+async def create_ventas_batch(ventas: List[venta.VentaLote], token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "propietario" and current_user.rol != "dependiente":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    if len(ventas) > LOTE_MAXIMO:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"El lote no puede tener más de {LOTE_MAXIMO} ventas")
+
+    # una clave repetida dentro del lote es la misma venta
+    lote = {}
+    for row in ventas:
+        lote.setdefault(row.clave, row)
+
+    resultados = {}
+
+    # reservar las claves nuevas, las demas ya se procesaron en un envio anterior
+    ruta = "/ventas/batch"
+    reservadas = await idempotencia.reservar(session, current_user.id, ruta, list(lote.keys()))
+
+    anteriores = await idempotencia.respuestas(session, current_user.id, [clave for clave in lote if clave not in reservadas])
+    for clave, (ruta_anterior, guardada) in anteriores.items():
+        if ruta_anterior != ruta or guardada is None:
+            resultados[clave] = {"clave": clave, "estado": "rechazada",
+                                 "detalle": "La clave ya fue usada en otra operación"}
+        else:
+            resultados[clave] = {**guardada, "estado": "repetida"}
+
+    # existencia y negocio de todas las distribuciones del lote en una sola consulta
+    nuevas = [row for clave, row in lote.items() if clave in reservadas]
+    disponible = await existencia.bloquear(session, {row.distribucion_id for row in nuevas})
+
+    # asignar la existencia en el orden del lote
+    aceptadas = []
+    pedido = {}
+    for row in nuevas:
+        existencia_row = disponible.get(row.distribucion_id)
+
+        # el punto es del usuario y la distribucion es de un inventario del mismo negocio
+        if not alcance.punto(row.punto_id) or existencia_row is None or existencia_row[1] != alcance.puntos[row.punto_id]:
+            detalle = "No está autorizado a realizar esta acción"
+        elif row.cantidad <= 0 or existencia_row[0] - pedido.get(row.distribucion_id, 0) < row.cantidad:
+            detalle = "El producto no está disponible"
+        else:
+            pedido[row.distribucion_id] = pedido.get(row.distribucion_id, 0) + row.cantidad
+            aceptadas.append(row)
+            continue
+
+        resultados[row.clave] = {"clave": row.clave, "estado": "rechazada", "detalle": detalle}
+
+    await idempotencia.liberar(session, current_user.id, [row.clave for row in nuevas if row.clave in resultados])
+
+    if aceptadas:
+        # descontar la existencia de todas las distribuciones en una sola sentencia
+        await existencia.ajustar(session, {distribucion_id: -cantidad for distribucion_id, cantidad in pedido.items()})
+
+        # insertar todas las ventas en una sola sentencia y obtener sus id
+        ventas_id = (await session.scalars(db.insert(models.Venta).returning(models.Venta.id, sort_by_parameter_order=True),
+            [{
+                "distribucion_id": row.distribucion_id,
+                "cantidad": row.cantidad,
+                "precio": row.precio,
+                "fecha": fecha.naive_utc(row.fecha) - fecha.DESFASE,
+                "punto_id": row.punto_id,
+                "usuario_id": current_user.id,
+                "monto": row.cantidad * row.precio,
+                "pago_diferido": row.pago_diferido,
+                "descripcion": row.descripcion,
+                "pago_electronico": row.pago_electronico,
+                "no_operacion": row.no_operacion,
+            } for row in aceptadas]))\
+            .all()
+
+        await venta_diaria.sumar(session, models.Venta.id.in_(ventas_id))
+
+        creadas = {}
+        for row, venta_id in zip(aceptadas, ventas_id):
+            creadas[row.clave] = {"clave": row.clave, "estado": "creada", "id": venta_id}
+
+            # el log se guarda en la misma transaccion que la venta
+            await log.create_log({
+                "usuario": current_user.usuario,
+                "accion": "CREATE",
+                "tabla": "Venta",
+                "descripcion": f"Ha creado el id {venta_id}"
+            }, session)
+
+        # la respuesta de cada clave se confirma junto con su venta
+        await idempotencia.guardar(session, current_user.id, creadas)
+        resultados.update(creadas)
+
+    await session.commit()
+
+    if aceptadas:
+        await cache.invalidar_puntos(session, *{row.punto_id for row in aceptadas})
+
+    # un resultado por venta recibida, las claves repetidas en el lote remiten a la primera
+    enviados = []
+    vistas = set()
+    for row in ventas:
+        resultado = resultados[row.clave]
+        if row.clave in vistas and resultado["estado"] == "creada":
+            resultado = {**resultado, "estado": "repetida"}
+        vistas.add(row.clave)
+        enviados.append(resultado)
+
+    return enviados
+
+
 @router.get("/venta/{id}", response_model=venta.VentaGet, tags=["venta"], description="Obtener venta")
-async def read_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario" and current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-    
     # get the venta item with the given id
-    ventadb = session.query(models.Venta.distribucion_id,models.Venta.precio, models.Venta.fecha,
+    ventadb = (await session.execute(db.select(models.Venta.distribucion_id,models.Venta.precio, models.Venta.fecha,
                             models.Venta.punto_id, models.Venta.cantidad, models.Producto.nombre,
                             models.Venta.pago_diferido, models.Venta.descripcion, models.Venta.pago_electronico,
                             models.Venta.no_operacion)\
@@ -111,12 +317,9 @@ async def read_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)]
         .join(models.Inventario)\
         .join(models.Producto)\
         .join(models.Negocio)\
-        .where(models.Venta.id == id, models.Negocio.propietario_id == current_user.id)\
+        .where(models.Venta.id == id, models.Negocio.propietario_id == current_user.id)))\
         .first()
 
-    # close the session
-    session.close()
-
     if not ventadb:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Venta con id {id} no encontrada")
@@ -137,38 +340,36 @@ async def read_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)]
 
 
 @router.put("/venta/{id}", tags=["venta"], description="Actualizar venta")
-async def update_venta(id: int, venta: venta.VentaCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def update_venta(id: int, venta: venta.VentaCreate, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], alcance: Annotated[permisos.Alcance, Depends(permisos.get_alcance)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario" and current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    if current_user.rol == "propietario":
-        # verificar si usuario autenticado le pertenece la distribucion y el punto
-        distribuciondb = session.query(models.Distribucion)\
-            .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-            .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
-            .join(models.Punto, models.Punto.negocio_id == models.Negocio.id)\
-            .where(models.Negocio.propietario_id == current_user.id, models.Distribucion.id == venta.distribucion_id, 
-                   models.Punto.id == venta.punto_id, models.Negocio.fecha_licencia >= date.today())\
-            .count()
-
-        if not distribuciondb:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail=f"No está autorizado a realizar esta acción")
-
     # get the venta item with the given id
-    ventadb: venta.Venta = session.query(models.Venta).get(id)
+    ventadb: venta.Venta = await session.get(models.Venta, id)
 
-    time_diff = timedelta(hours=5)
-    new_time = venta.fecha - time_diff
+    # verificar si usuario autenticado le pertenece el punto de la venta, su distribucion no cambia
+    if ventadb and not alcance.punto(ventadb.punto_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    new_time = fecha.naive_utc(venta.fecha) - fecha.DESFASE
 
     # update todo item with the given task (if an item with the given id was found)
     if ventadb:
+        # ajustar la existencia con la diferencia de cantidad
+        diferencia = venta.cantidad - ventadb.cantidad
+        if diferencia > 0 and not await existencia.vender(session, {ventadb.distribucion_id: diferencia}):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                detail=f"El producto no está disponible")
+        if diferencia < 0:
+            await existencia.ajustar(session, {ventadb.distribucion_id: -diferencia})
+
+        # la venta sale del acumulado con sus valores anteriores y vuelve con los nuevos
+        await venta_diaria.restar(session, models.Venta.id == ventadb.id)
+
         ventadb.cantidad = venta.cantidad
         ventadb.precio = venta.precio
         ventadb.fecha = new_time
@@ -177,58 +378,54 @@ async def update_venta(id: int, venta: venta.VentaCreate, token: Annotated[str,
         ventadb.descripcion = venta.descripcion
         ventadb.pago_electronico = venta.pago_electronico
         ventadb.no_operacion = venta.no_operacion
-        session.commit()
+        await venta_diaria.sumar(session, models.Venta.id == ventadb.id)
+        await session.commit()
+        await cache.invalidar_puntos(session, ventadb.punto_id)
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "UPDATE",
             "tabla": "Venta",
             "descripcion": f"Ha editado el id {ventadb.id}"
         })
 
-    # close the session
-    session.close()
-
 
 @router.delete("/venta/{id}", status_code=status.HTTP_204_NO_CONTENT, tags=["venta"], description="Eliminar venta")
-async def delete_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def delete_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario" and current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the venta item with the given id
-    #ventadb = session.query(models.Venta).get(id)
+    #ventadb = await session.get(models.Venta, id)
 
     if current_user.rol == "propietario":
         # get the venta item with the given id
-        ventadb = session.query(models.Venta)\
+        ventadb = await session.scalar(db.select(models.Venta)\
             .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
             .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
             .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
-            .where(models.Venta.id == id, models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today())\
-            .first()
+            .where(models.Venta.id == id, models.Negocio.propietario_id == current_user.id, models.Negocio.fecha_licencia >= date.today()))
 
     if current_user.rol == "dependiente":
-        ventadb = session.query(models.Venta)\
+        ventadb = await session.scalar(db.select(models.Venta)\
             .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
             .join(models.Punto, models.Punto.id == models.Distribucion.punto_id)\
             .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
             .where(models.Venta.id == id, models.Punto.id == current_user.punto_id, models.Venta.usuario_id == current_user.id,
-                    models.Negocio.fecha_licencia >= date.today())\
-            .first()
+                    models.Negocio.fecha_licencia >= date.today()))
 
     # if todo item with given id exists, delete it from the database. Otherwise raise 404 error
     if ventadb:
-        session.delete(ventadb)
-        session.commit()
-        session.close()
+        await existencia.ajustar(session, {ventadb.distribucion_id: ventadb.cantidad})
+        await venta_diaria.restar(session, models.Venta.id == ventadb.id)
+        await session.delete(ventadb)
+        await session.commit()
+        await cache.invalidar_puntos(session, ventadb.punto_id)
 
-        log.create_log({
+        await log.create_log({
             "usuario": current_user.usuario,
             "accion": "DELETE",
             "tabla": "Venta",
@@ -241,56 +438,62 @@ async def delete_venta(id: int, token: Annotated[str, Depends(auth.oauth2_scheme
     return None
 
 
-@router.get("/ventas", tags=["ventas"], description="Listado de ventas de un propietario")
-async def read_ventas_propietario(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+@router.get("/ventas", tags=["ventas"], description="Listado de ventas de un propietario, paginado por cursor")
+async def read_ventas_propietario(filtro: Annotated[dict, Depends(filtro_ventas)], token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)],
+                                  cursor: str | None = None, limite: Annotated[int | None, Query(ge=1, le=LIMITE_MAXIMO)] = None):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+    condiciones = [models.Negocio.propietario_id == current_user.id] + condiciones_ventas(filtro)
+
+    return await pagina_ventas(session, condiciones, cursor, limite)
+
 
-    # get the negocio item with the given id
-    ventasdb = session.query(models.Venta.id, models.Producto.nombre,
-                             models.Punto.nombre, models.Venta.cantidad,
-                             models.Venta.precio, models.Venta.fecha,
-                             models.User.nombre, models.Venta.pago_diferido,
-                             models.Venta.descripcion, models.Venta.pago_electronico
-                             )\
+@router.get("/ventas-totales", tags=["ventas"], description="Totales de las ventas de un propietario")
+async def read_ventas_propietario_totales(filtro: Annotated[dict, Depends(filtro_ventas)], token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "propietario":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    condiciones = [models.Negocio.propietario_id == current_user.id] + condiciones_ventas(filtro)
+
+    return await totales_ventas(session, condiciones, filtro)
+
+
+@router.get("/ventas-exportar", tags=["ventas"], description="Exportar ventas de un propietario en ndjson o csv")
+async def export_ventas_propietario(filtro: Annotated[dict, Depends(filtro_ventas)], token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)],
+                                    formato: Literal["ndjson", "csv"] = "ndjson"):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "propietario":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    stmt = db.select(models.Venta.id, models.Venta.fecha, models.Producto.nombre, models.Punto.nombre,
+                     models.Venta.cantidad, models.Venta.precio, models.Venta.monto, models.User.nombre,
+                     models.Venta.pago_electronico, models.Venta.no_operacion, models.Venta.pago_diferido,
+                     models.Venta.descripcion, models.Venta.factura_id)\
         .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
         .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
         .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
         .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
         .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
         .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Negocio.propietario_id == current_user.id)\
-        .order_by(models.Venta.fecha.desc(), models.Producto.nombre)\
-        .all()
+        .where(models.Negocio.propietario_id == current_user.id, *condiciones_ventas(filtro))\
+        .order_by(models.Venta.fecha, models.Venta.id)
 
-    resultdb = []
-    for row in ventasdb:
-        resultdb.append({
-            "id": row[0],
-            "nombre_producto": row[1],
-            "nombre_punto": row[2],
-            "cantidad": row[3],
-            "precio": row[4],
-            "monto": row[3] * row[4],
-            "fecha": row[5],
-            "dependiente": row[6],
-            "pago_diferido": row[7],
-            "descripcion": row[8],
-            "pago_electronico": row[9],
-        })
-
-    session.close()
-    return resultdb
+    return exportar.exportar(stmt, ["id", "fecha", "nombre_producto", "nombre_punto", "cantidad", "precio", "monto",
+                                    "dependiente", "pago_electronico", "no_operacion", "pago_diferido", "descripcion",
+                                    "factura_id"], formato, "ventas")
 
 
 @router.get("/ventas-periodo/{fecha_inicio}/{fecha_fin}/{negocio}", tags=["ventas"])
-async def read_ventas_periodo(fecha_inicio: date, fecha_fin: date, negocio: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_ventas_periodo(fecha_inicio: date, fecha_fin: date, negocio: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db_lectura)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
@@ -302,41 +505,25 @@ async def read_ventas_periodo(fecha_inicio: date, fecha_fin: date, negocio: int,
         raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
                             detail=f"La fecha fin debe ser mayor que la fecha inicio")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
-    # get the negocio item with the given id
-    ventasdb = session.query(models.Producto.nombre,
-                             models.Punto.nombre, db.func.sum(models.Venta.cantidad),
-                             db.func.row_number().over())\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
+    # acumulado diario de las ventas del negocio
+    ventasdb = await session.execute(db.select(models.Producto.nombre.label("nombre_producto"),
+                             models.Punto.nombre.label("nombre_punto"), db.func.sum(models.VentaDiaria.cantidad).label("cantidad"),
+                             db.func.row_number().over().label("id"))\
+        .join(models.Producto, models.Producto.id == models.VentaDiaria.producto_id)\
+        .join(models.Punto, models.Punto.id == models.VentaDiaria.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.VentaDiaria.negocio_id)\
         .where(models.Negocio.propietario_id == current_user.id,
-               db.func.date(models.Venta.fecha) >= fecha_inicio, db.func.date(models.Venta.fecha) <= fecha_fin,
+               fecha.rango(models.VentaDiaria.dia, fecha_inicio, fecha_fin),
                models.Negocio.id == negocio)\
         .group_by(models.Producto.nombre, models.Punto.nombre)\
-        .order_by(db.func.sum(models.Venta.cantidad).desc())\
-        .all()
+        .having(db.func.sum(models.VentaDiaria.cantidad) != 0)\
+        .order_by(db.func.sum(models.VentaDiaria.cantidad).desc()))
 
-    resultdb = []
-    for row in ventasdb:
-        resultdb.append({
-            "nombre_producto": row[0],
-            "nombre_punto": row[1],
-            "cantidad": row[2],
-            "id": row[3],
-        })
-
-    session.close()
-    return resultdb
+    return respuesta.RespuestaJSON(respuesta.filas(ventasdb))
 
 
 @router.get("/ventas-brutas-periodo/{fecha_inicio}/{fecha_fin}/", tags=["ventas"])
-async def read_ventas_brutas_periodo(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_ventas_brutas_periodo(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
@@ -348,37 +535,37 @@ async def read_ventas_brutas_periodo(fecha_inicio: date, fecha_fin: date, token:
         raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
                             detail=f"La fecha fin debe ser mayor que la fecha inicio")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+    # respuesta guardada mientras no cambien los negocios del propietario
+    clave, resultdb = await cache.leer(session, "ventas-brutas-periodo", current_user.id, fecha_inicio, fecha_fin)
+    if resultdb is not None:
+        return resultdb
 
-    # get the negocio item with the given id
-    ventasdb = session.query(db.func.sum(models.Venta.monto),
-                             db.extract("year", models.Venta.fecha), db.extract("month", models.Venta.fecha),
-                             db.extract("day", models.Venta.fecha))\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Negocio, models.Negocio.id == models.Inventario.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
+    # acumulado diario de las ventas de los negocios del propietario
+    ventasdb = (await session.execute(db.select(db.func.sum(models.VentaDiaria.monto), models.VentaDiaria.dia)\
+        .join(models.Negocio, models.Negocio.id == models.VentaDiaria.negocio_id)\
         .where(models.Negocio.propietario_id == current_user.id,
-               db.func.date(models.Venta.fecha) >= fecha_inicio, db.func.date(models.Venta.fecha) <= fecha_fin)\
-        .group_by(db.extract("year", models.Venta.fecha), db.extract("month", models.Venta.fecha), db.extract("day", models.Venta.fecha))\
-        .order_by(db.extract("year", models.Venta.fecha).desc(), db.extract("month", models.Venta.fecha).desc(), db.extract("day", models.Venta.fecha).desc())\
+               fecha.rango(models.VentaDiaria.dia, fecha_inicio, fecha_fin))\
+        .group_by(models.VentaDiaria.dia)\
+        .having(db.func.sum(models.VentaDiaria.cantidad) != 0)\
+        .order_by(models.VentaDiaria.dia.desc())))\
         .all()
 
     resultdb = []
     for row in ventasdb:
         resultdb.append({
             "monto": row[0],
-            "fecha": f"{row[1]}-{row[2]}-{row[3]}",
-            "id": f"id{row[1]}-{row[2]}-{row[3]}",
+            "fecha": f"{row[1].year}-{row[1].month}-{row[1].day}",
+            "id": f"id{row[1].year}-{row[1].month}-{row[1].day}",
         })
 
-    session.close()
+    await cache.guardar(clave, resultdb)
+
     return resultdb
 
 
 @router.get("/ventas-utilidades-periodo/{fecha_inicio}/{fecha_fin}/{negocio}", tags=["ventas"])
-async def read_utilidades_periodo(fecha_inicio: date, fecha_fin: date, negocio: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_utilidades_periodo(fecha_inicio: date, fecha_fin: date, negocio: int, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)],
+                                  niveles: Annotated[List[Literal["producto", "negocio", "total"]], Query()] = ["producto"]):
 
     # validando rol de usuario autenticado
     if current_user.rol != "propietario":
@@ -390,113 +577,84 @@ async def read_utilidades_periodo(fecha_inicio: date, fecha_fin: date, negocio:
         raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
                             detail=f"La fecha fin debe ser mayor que la fecha inicio")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+    # respuesta guardada mientras no cambien los negocios del propietario
+    clave, resultdb = await cache.leer(session, "ventas-utilidades-periodo", current_user.id, fecha_inicio, fecha_fin, negocio, sorted(niveles))
+    if resultdb is not None:
+        return respuesta.RespuestaJSON(resultdb)
 
-    # get the negocio item with the given id
-    ventasdb = session.query(models.Producto.nombre,
-                             models.Punto.nombre, db.func.sum(models.Venta.cantidad),
-                             db.func.row_number().over(), models.Inventario.costo,
-                             db.func.sum(models.Venta.monto), models.Inventario.precio_venta)\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Negocio.propietario_id == current_user.id,
-               db.func.date(models.Venta.fecha) >= fecha_inicio, db.func.date(models.Venta.fecha) <= fecha_fin,
-               models.Negocio.id == negocio)\
-        .group_by(models.Producto.nombre, models.Punto.nombre, models.Inventario.costo, models.Inventario.precio_venta)\
-        .order_by(db.func.sum(models.Venta.cantidad).desc())\
-        .all()
+    # una fila por producto y punto, con el subtotal del negocio y el total si se piden
+    resultdb = await utilidad.utilidades(session, current_user.id, fecha_inicio, fecha_fin, niveles, negocio)
 
-    resultdb = []
-    for row in ventasdb:
-        resultdb.append({
-            "nombre_producto": row[0],
-            "nombre_punto": row[1],
-            "cantidad": row[2],
-            "id": row[3],
-            "precio_costo": row[4] * row[2],
-            "monto": row[5],
-            "utilidad": row[5] - (row[4] * row[2]),
-            "precio_inventario": row[6],
-            "utilidad_esperada": (row[6] * row[2]) - (row[4] * row[2]),
-            "diferencia_utilidad": (row[5] - (row[4] * row[2])) - ((row[6] * row[2]) - (row[4] * row[2])),
-        })
+    await cache.guardar(clave, resultdb)
 
-    session.close()
-    return resultdb
+    return respuesta.RespuestaJSON(resultdb)
+
+
+@router.get("/ventas-utilidades/{fecha_inicio}/{fecha_fin}", tags=["ventas"], description="Utilidades de todos los negocios del propietario")
+async def read_utilidades_negocios(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)],
+                                   niveles: Annotated[List[Literal["producto", "negocio", "total"]], Query()] = ["producto", "negocio", "total"]):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "propietario":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    if fecha_inicio > fecha_fin:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail=f"La fecha fin debe ser mayor que la fecha inicio")
+
+    clave, resultdb = await cache.leer(session, "ventas-utilidades", current_user.id, fecha_inicio, fecha_fin, sorted(niveles))
+    if resultdb is not None:
+        return respuesta.RespuestaJSON(resultdb)
+
+    # con niveles=negocio&niveles=total solo se devuelven los subtotales, sin el detalle por producto
+    resultdb = await utilidad.utilidades(session, current_user.id, fecha_inicio, fecha_fin, niveles)
+
+    await cache.guardar(clave, resultdb)
 
+    return respuesta.RespuestaJSON(resultdb)
 
-@router.get("/ventas-punto", tags=["ventas"], description="Listado de ventas de un punto")
-async def read_ventas_dependiente(token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+
+@router.get("/ventas-punto", tags=["ventas"], description="Listado de ventas de un punto, paginado por cursor")
+async def read_ventas_dependiente(filtro: Annotated[dict, Depends(filtro_ventas)], token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)],
+                                  cursor: str | None = None, limite: Annotated[int | None, Query(ge=1, le=LIMITE_MAXIMO)] = None):
 
     # validando rol de usuario autenticado
     if current_user.rol != "dependiente":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
+    # el dependiente solo ve las ventas de su punto
+    condiciones = [models.Venta.punto_id == current_user.punto_id] + condiciones_ventas(filtro)
 
-    # get the negocio item with the given id
-    ventasdb = session.query(models.Venta.id, models.Producto.nombre,
-                             models.Punto.nombre, models.Venta.cantidad,
-                             models.Venta.precio, models.Venta.fecha,
-                             models.User.nombre, models.Venta.pago_diferido, models.Venta.descripcion,
-                             models.Venta.pago_electronico
-                             )\
-        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
-        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
-        .join(models.Producto, models.Producto.id == models.Inventario.producto_id)\
-        .join(models.Punto, models.Punto.id == models.Venta.punto_id)\
-        .join(models.Negocio, models.Negocio.id == models.Punto.negocio_id)\
-        .join(models.User, models.User.id == models.Venta.usuario_id)\
-        .where(models.Punto.id == current_user.punto_id)\
-        .order_by(models.Venta.fecha.desc())\
-        .all()
+    return await pagina_ventas(session, condiciones, cursor, limite)
 
-    resultdb = []
-    for row in ventasdb:
-        resultdb.append({
-            "id": row[0],
-            "nombre_producto": row[1],
-            "nombre_punto": row[2],
-            "cantidad": row[3],
-            "precio": row[4],
-            "monto": row[3] * row[4],
-            "fecha": row[5],
-            "dependiente": row[6],
-            "pago_diferido": row[7],
-            "descripcion": row[8],
-            "pago_electronico": row[9],
-        })
 
-    session.close()
-    return resultdb
+@router.get("/ventas-punto-totales", tags=["ventas"], description="Totales de las ventas de un punto")
+async def read_ventas_dependiente_totales(filtro: Annotated[dict, Depends(filtro_ventas)], token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
+
+    # validando rol de usuario autenticado
+    if current_user.rol != "dependiente":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"No está autorizado a realizar esta acción")
+
+    condiciones = [models.Venta.punto_id == current_user.punto_id] + condiciones_ventas(filtro)
+
+    return await totales_ventas(session, condiciones, filtro)
 
 
 @router.get("/ventas-contador/{fecha_inicio}/{fecha_fin}", tags=["admin"], description="Contador de ventas")
-async def read_count_ventas(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)]):
+async def read_count_ventas(fecha_inicio: date, fecha_fin: date, token: Annotated[str, Depends(auth.oauth2_scheme)], current_user: Annotated[models.User, Depends(auth.get_current_user)], session: Annotated[AsyncSession, Depends(get_db)]):
 
     #validando rol de usuario autenticado
     if current_user.rol != "superadmin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No está autorizado a realizar esta acción")
 
-    # create a new database session
-    session = Session(bind=engine, expire_on_commit=False)
-
     # get the ventas item with the given id
-    contadorVentas = session.query(models.Venta).count()
+    contadorVentas = await session.scalar(db.select(db.func.count()).select_from(models.Venta))
 
-    contadorVentasFecha = session.query(models.Venta)\
-                                .where(db.func.date(models.Venta.fecha_creado) >= fecha_inicio, db.func.date(models.Venta.fecha_creado) <= fecha_fin)\
-                                .count()
+    contadorVentasFecha = await session.scalar(db.select(db.func.count()).select_from(models.Venta)\
+                                .where(fecha.rango(models.Venta.fecha_creado, fecha_inicio, fecha_fin)))
 
-    # close the session
-    session.close()
-    
     return {"cantidad_ventas": contadorVentas, "nuevas_ventas":contadorVentasFecha }
\ No newline at end of file
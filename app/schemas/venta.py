@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 # Create Venta Schema (Pydantic Model)
@@ -12,6 +12,20 @@ class VentaCreate(BaseModel):
     no_operacion: str | None
     pago_diferido: bool
     descripcion: str | None
+
+
+# Venta de un lote con la clave de idempotencia del cliente
+class VentaLote(VentaCreate):
+    clave: str = Field(min_length=1, max_length=256)
+
+
+# Resultado de cada venta de un lote: creada, repetida o rechazada
+class VentaLoteResultado(BaseModel):
+    clave: str
+    estado: str
+    id: int | None = None
+    detalle: str | None = None
+
     
 # Complete Venta Schema (Pydantic Model)
 class Venta(BaseModel):
@@ -0,0 +1,85 @@
+from datetime import date
+from sqlalchemy.ext.asyncio import AsyncSession
+import sqlalchemy as db
+from ..models import models
+from ..fecha import fecha
+from ..respuesta import respuesta
+
+# utilidades de las ventas de un periodo a partir del acumulado diario, en una sola consulta
+# niveles: producto (por negocio, producto y punto), negocio (subtotal de cada negocio) y total
+# en postgres los niveles se agrupan con GROUPING SETS en un solo recorrido de venta_diaria,
+# en otros motores (sqlite en pruebas locales) con UNION ALL de un agrupamiento por nivel
+
+NIVELES = ("producto", "negocio", "total")
+
+
+def columnas(nivel: str):
+
+    # columnas de agrupamiento de cada nivel, en el orden en que se seleccionan
+    negocio = [models.Negocio.id.label("negocio_id"), models.Negocio.nombre.label("nombre_negocio")]
+    producto = [models.Producto.id.label("producto_id"), models.Producto.nombre.label("nombre_producto"),
+                models.Punto.id.label("punto_id"), models.Punto.nombre.label("nombre_punto")]
+
+    return {"producto": negocio + producto, "negocio": negocio, "total": []}[nivel]
+
+
+def agrupado(condiciones: list, seleccion: list, nivel, group_by):
+
+    # totales exactos del periodo, las utilidades y diferencias se calculan sobre las sumas
+    # el precio promedio se lee sin la escala de las cantidades
+    cantidad = db.func.sum(models.VentaDiaria.cantidad)
+    costo = db.func.sum(models.VentaDiaria.costo)
+    monto = db.func.sum(models.VentaDiaria.monto)
+    esperado = db.func.sum(models.VentaDiaria.monto_esperado)
+
+    return db.select(nivel.label("nivel"), *seleccion,
+                     cantidad.label("cantidad"), costo.label("precio_costo"), monto.label("monto"),
+                     (monto - costo).label("utilidad"),
+                     db.type_coerce(esperado / cantidad, models.ACUMULADO).label("precio_inventario"),
+                     (esperado - costo).label("utilidad_esperada"),
+                     (monto - esperado).label("diferencia_utilidad"))\
+        .select_from(models.VentaDiaria)\
+        .join(models.Producto, models.Producto.id == models.VentaDiaria.producto_id)\
+        .join(models.Punto, models.Punto.id == models.VentaDiaria.punto_id)\
+        .join(models.Negocio, models.Negocio.id == models.VentaDiaria.negocio_id)\
+        .where(*condiciones)\
+        .group_by(*group_by)\
+        .having(cantidad != 0)
+
+
+def consulta(dialecto: str, condiciones: list, niveles: list):
+
+    niveles = [nivel for nivel in NIVELES if nivel in niveles]
+    detalle = columnas("producto")
+
+    if dialecto == "postgresql":
+        # grouping() vale 1 en las columnas que no forman parte del conjunto de la fila
+        etiqueta = db.case((db.func.grouping(models.Producto.id) == 0, "producto"),
+                        (db.func.grouping(models.Negocio.id) == 0, "negocio"),
+                        else_="total")
+        conjuntos = [db.tuple_(*[col.element for col in columnas(nivel)]) for nivel in niveles]
+        filas = agrupado(condiciones, detalle, etiqueta, [db.func.grouping_sets(*conjuntos)]).subquery()
+    else:
+        filas = db.union_all(*[agrupado(condiciones,
+                                        [col if col.name in {c.name for c in columnas(nivel)} else db.null().label(col.name)
+                                         for col in detalle],
+                                        db.literal(nivel), [col.element for col in columnas(nivel)])
+                               for nivel in niveles]).subquery()
+
+    # cada negocio con sus filas por cantidad vendida y su subtotal, el total al final
+    orden = db.case({nivel: indice for indice, nivel in enumerate(NIVELES)}, value=filas.c.nivel)
+    orden = [filas.c.negocio_id.is_(None), filas.c.negocio_id, orden, filas.c.cantidad.desc()]
+
+    return db.select(db.func.row_number().over(order_by=orden).label("id"), *filas.c)\
+        .order_by(*orden)
+
+
+async def utilidades(session: AsyncSession, propietario_id: int, fecha_inicio: date, fecha_fin: date,
+                     niveles: list, negocio: int | None = None):
+
+    condiciones = [models.Negocio.propietario_id == propietario_id,
+                   fecha.rango(models.VentaDiaria.dia, fecha_inicio, fecha_fin)]
+    if negocio is not None:
+        condiciones.append(models.Negocio.id == negocio)
+
+    return respuesta.filas(await session.execute(consulta(session.get_bind().dialect.name, condiciones, niveles)))
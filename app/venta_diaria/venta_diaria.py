@@ -0,0 +1,90 @@
+import sys
+import logging
+from datetime import date
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects import postgresql, sqlite
+import sqlalchemy as db
+from ..database.database import engine
+from ..models import models
+from ..fecha import fecha
+
+# ventas acumuladas por (negocio, dia, punto, producto) para los reportes por periodo
+# se mantiene en la misma transaccion que la venta: se resta antes de modificar o eliminar
+# las ventas y se suma despues de crearlas o modificarlas
+# reconstruir: python -m app.venta_diaria.venta_diaria [desde] [hasta]
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS = ["negocio_id", "dia", "punto_id", "producto_id", "cantidad", "monto", "costo",
+            "monto_esperado", "monto_electronico", "monto_efectivo"]
+
+ACUMULADAS = COLUMNAS[4:]
+
+
+def agregado(condicion, signo: int = 1):
+
+    # ventas que cumplen la condicion agrupadas por dia, con el costo y precio del inventario
+    dia = db.func.date(models.Venta.fecha, type_=db.Date)
+    electronico = db.func.coalesce(models.Venta.pago_electronico, False)
+
+    def suma(valor):
+        return db.func.sum(valor) * signo
+
+    return db.select(models.Inventario.negocio_id, dia, models.Venta.punto_id, models.Inventario.producto_id,
+                     suma(models.Venta.cantidad),
+                     suma(models.Venta.monto),
+                     suma(models.Venta.cantidad * models.Inventario.costo),
+                     suma(models.Venta.cantidad * models.Inventario.precio_venta),
+                     suma(db.case((electronico, models.Venta.monto), else_=0)),
+                     suma(db.case((electronico, 0), else_=models.Venta.monto)))\
+        .join(models.Distribucion, models.Distribucion.id == models.Venta.distribucion_id)\
+        .join(models.Inventario, models.Inventario.id == models.Distribucion.inventario_id)\
+        .where(condicion)\
+        .group_by(models.Inventario.negocio_id, dia, models.Venta.punto_id, models.Inventario.producto_id)
+
+
+def acumular(dialecto: str, condicion, signo: int = 1):
+
+    # insert ... select ... on conflict: suma los valores a las filas existentes del dia
+    insert = postgresql.insert if dialecto == "postgresql" else sqlite.insert
+    stmt = insert(models.VentaDiaria).from_select(COLUMNAS, agregado(condicion, signo))
+
+    return stmt.on_conflict_do_update(
+        index_elements=COLUMNAS[:4],
+        set_={columna: getattr(models.VentaDiaria, columna) + getattr(stmt.excluded, columna) for columna in ACUMULADAS})
+
+
+async def sumar(session: AsyncSession, condicion):
+
+    # sumar las ventas que cumplen la condicion, despues de crearlas o modificarlas
+    await session.flush()
+    await session.execute(acumular(session.get_bind().dialect.name, condicion))
+
+
+async def restar(session: AsyncSession, condicion):
+
+    # restar las ventas que cumplen la condicion, antes de modificarlas o eliminarlas
+    await session.flush()
+    await session.execute(acumular(session.get_bind().dialect.name, condicion, -1))
+
+
+def reconstruir(conn, desde: date | None = None, hasta: date | None = None):
+
+    # recalcular los dias del rango a partir de las ventas
+    if conn.dialect.name == "postgresql":
+        # las ventas no cambian mientras se recalcula
+        conn.execute(db.text("LOCK TABLE venta IN SHARE MODE"))
+
+    conn.execute(db.delete(models.VentaDiaria).where(fecha.rango(models.VentaDiaria.dia, desde, hasta)))
+    conn.execute(acumular(conn.dialect.name, fecha.rango(models.Venta.fecha, desde, hasta)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    fechas = [date.fromisoformat(arg) for arg in sys.argv[1:3]]
+    desde, hasta = (fechas + [None, None])[:2]
+
+    with engine.begin() as conn:
+        reconstruir(conn, desde, hasta)
+
+    logger.info("venta_diaria reconstruida desde %s hasta %s", desde or "el inicio", hasta or "hoy")
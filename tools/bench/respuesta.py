@@ -0,0 +1,49 @@
+import sys
+import json
+import timeit
+from datetime import date
+from fastapi.encoders import jsonable_encoder
+import sqlalchemy as db
+from app.respuesta.respuesta import RespuestaJSON, filas
+
+# costo por fila de un listado antes y despues de RespuestaJSON
+# uso, desde la raiz del repositorio: python -m tools.bench.respuesta [filas]
+
+
+def benchmark(cantidad: int = 10000):
+
+    # filas como las del listado de distribuciones, leidas de sqlite en memoria
+    engine = db.create_engine("sqlite://")
+    with engine.connect() as conn:
+        conn.execute(db.text("CREATE TABLE d (id INTEGER, cantidad FLOAT, fecha DATE, punto TEXT, negocio TEXT, producto TEXT, costo FLOAT)"))
+        conn.execute(db.text("INSERT INTO d VALUES (:id, :cantidad, :fecha, 'Punto', 'Negocio', 'Producto', 1.5)"),
+                     [{"id": i, "cantidad": i * 0.5, "fecha": date(2024, 1, 1 + i % 28)} for i in range(cantidad)])
+
+        columnas = db.table("d", db.column("id"), db.column("cantidad"), db.column("fecha", db.Date), db.column("punto"),
+                            db.column("negocio"), db.column("producto"), db.column("costo"))
+        stmt = db.select(columnas.c.id, columnas.c.cantidad, columnas.c.fecha, columnas.c.punto.label("punto_id"),
+                         columnas.c.negocio.label("negocio_id"), columnas.c.producto.label("producto_id"), columnas.c.costo)
+        resultado = conn.execute(stmt).freeze()
+
+    def antes():
+        # dict por indice, jsonable_encoder y json de la respuesta por defecto
+        resultdb = []
+        for row in resultado():
+            resultdb.append({"id": row[0], "cantidad": row[1], "fecha": row[2], "punto_id": row[3],
+                             "negocio_id": row[4], "producto_id": row[5], "costo": row[6]})
+        return json.dumps(jsonable_encoder(resultdb), ensure_ascii=False, allow_nan=False,
+                          indent=None, separators=(",", ":")).encode("utf-8")
+
+    def despues():
+        return RespuestaJSON(filas(resultado())).body
+
+    if json.loads(antes()) != json.loads(despues()):
+        sys.exit("Las dos respuestas no coinciden")
+
+    for nombre, funcion in (("antes", antes), ("despues", despues)):
+        segundos = min(timeit.repeat(funcion, number=1, repeat=5))
+        print(f"{nombre}: {segundos * 1e6 / cantidad:.2f} us por fila ({cantidad} filas)")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)